@@ -0,0 +1,104 @@
+"""
+Compare the pivot aggregates on a wide dynamic table.
+
+    python benchmarks/pivot.py --settings=django_dynamic_database.tests.test_sqlite_settings
+
+The tables are created in a test database, destroyed on exit.
+"""
+import json
+import os
+import sys
+import timeit
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = OptionParser()
+    parser.add_option('-s', '--settings', help='Define settings.')
+    parser.add_option('-c', '--columns', default='10,50,200', help='Column counts. Default 10,50,200.')
+    parser.add_option('-r', '--rows', type='int', default=2000, help='Rows per table. Default 2000.')
+    parser.add_option('-n', '--repeat', type='int', default=5, help='Timed reads per strategy. Default 5.')
+    options, args = parser.parse_args()
+
+    if not options.settings:
+        parser.print_help()
+        sys.exit(1)
+
+    return options
+
+
+def fill_table(name, columns, rows):
+    from django_dynamic_database.models import Table, Column, Row, Cell
+
+    table = Table.objects.create(name=name)
+    Column.objects.bulk_create([Column(table=table, name='col_%s' % i) for i in range(columns)])
+    column_ids = list(table.columns.values_list('id', flat=True))
+    Row.objects.bulk_create([Row(table=table) for i in range(rows)])
+    cells = [
+        Cell(table=table, primary_key_id=row_id, value_type_id=column_id, value='value %s %s' % (row_id, column_id))
+        for row_id in table.rows.values_list('id', flat=True)
+        for column_id in column_ids
+    ]
+    Cell.objects.bulk_create(cells)
+    return table, column_ids
+
+
+def read_pivot(table, annotations):
+    from django_dynamic_database.models import Cell
+
+    return list(
+        Cell.objects.filter(table=table).values('primary_key').annotate(**annotations).order_by()
+    )
+
+
+def read_json(table):
+    # One JSON object per row, as DynamicDBModelQuerySet.json_rows()
+    from django.db.models import CharField
+    from django.db.models.functions import Cast
+    from django_dynamic_database.django_dynamic_database import JSONObjectAgg
+    from django_dynamic_database.models import Cell
+
+    rows = Cell.objects.filter(table=table).values('primary_key').annotate(
+        data=JSONObjectAgg(Cast('value_type_id', CharField()), 'value')
+    ).values_list('primary_key', 'data').order_by()
+    return [(pk, data if isinstance(data, dict) else json.loads(data)) for pk, data in rows]
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    os.environ['DJANGO_SETTINGS_MODULE'] = options.settings
+
+    # Local imports because DJANGO_SETTINGS_MODULE needs to be set first
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.db.models import Case, When, F
+    from django_dynamic_database.django_dynamic_database import Concat, PivotCompiler, get_pivot_compiler
+    from django_dynamic_database.models import Column
+
+    strategies = [
+        ('GROUP_CONCAT', lambda pk: Concat(Case(When(value_type_id=pk, then=F('value'))))),
+        ('MAX(CASE)', lambda pk: PivotCompiler().get_annotation(pk, Column.TEXT)),
+    ]
+    compiler = get_pivot_compiler()
+    if type(compiler) is not PivotCompiler:
+        strategies.append((type(compiler).__name__, lambda pk: compiler.get_annotation(pk, Column.TEXT)))
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        print('%s, %s rows, best of %s reads (s)' % (connection.vendor, options.rows, options.repeat))
+        print('%8s  %s  %20s' % ('columns', '  '.join('%20s' % name for name, build in strategies), 'JSON object'))
+        for columns in [int(c) for c in options.columns.split(',')]:
+            table, column_ids = fill_table('bench_%s' % columns, columns, options.rows)
+            timings = []
+            for name, build in strategies:
+                annotations = dict(('col_%s' % i, build(pk)) for i, pk in enumerate(column_ids))
+                timings.append(min(timeit.repeat(lambda: read_pivot(table, annotations), number=1, repeat=options.repeat)))
+            timings.append(min(timeit.repeat(lambda: read_json(table), number=1, repeat=options.repeat)))
+            print('%8s  %s' % (columns, '  '.join('%20.3f' % t for t in timings)))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1 @@
+default_app_config = 'django_dynamic_database.apps.DjangoDynamicDatabaseConfig'
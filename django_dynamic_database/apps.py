@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DjangoDynamicDatabaseConfig(AppConfig):
     name = 'django_dynamic_database'
+
+    def ready(self):
+        # Connect the schema cache and materialized pivot receivers
+        from . import receivers
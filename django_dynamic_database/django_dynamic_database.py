@@ -1,10 +1,29 @@
 import re
+import json
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 from itertools import chain
-from django.db import models
-from django.db.models import Aggregate, Sum, Q, F, Case, When
-from django.core.exceptions import ObjectDoesNotExist, FieldError
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, models, transaction
+from django.db.models import Aggregate, Func, Sum, Max, Min, Q, F, Case, When, Value, FilteredRelation
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import BaseIterable
+from django.core.exceptions import ObjectDoesNotExist, FieldError, EmptyResultSet
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from .models import Table, Column, Row, Cell
+from .signals import post_rows_save, pre_rows_delete
+from . import documents, materialized, partitions
+from . import instrumentation
+from .instrumentation import instrumented
 
 import types
 
@@ -16,7 +35,9 @@ That why we use custom functions GroupConcat and Concat.
 
 ---
 
-For the moment, we use Concat in the generated annotations
+The generated annotations pick the value of each column with MAX(), or
+GROUP_CONCAT() on SQLite, see PivotCompiler: the unique (primary_key,
+value_type) constraint leaves at most one value per group.
 
 """
 
@@ -51,6 +72,29 @@ class Concat(Aggregate):
         return self.as_sql(compiler, connection, function='ARRAY_TO_STRING', template="%(function)s(ARRAY_AGG(%(expressions)s), ',')")
 
 
+class JSONObjectAgg(Func):
+    """
+    Aggregate (key, value) pairs into one JSON object per group.
+    A Func flagged as an aggregate rather than an Aggregate: Django 2.2
+    rejects the aggregates of several arguments on SQLite.
+    """
+    function = 'JSON_OBJECTAGG'
+    contains_aggregate = True
+
+    def __init__(self, key, value, **extra):
+        super(JSONObjectAgg, self).__init__(key, value, output_field=models.TextField(), **extra)
+
+    def get_group_by_cols(self, alias=None):
+        # The group is the row, not the aggregated cells
+        return []
+
+    def as_sqlite(self, compiler, connection):
+        return self.as_sql(compiler, connection, function='JSON_GROUP_OBJECT')
+
+    def as_postgresql(self, compiler, connection):
+        return self.as_sql(compiler, connection, function='JSONB_OBJECT_AGG')
+
+
 class Sum(Aggregate):
     function = 'SUM'
     name = 'Sum'
@@ -66,10 +110,247 @@ class Sum(Aggregate):
 
     def as_postgresql(self, compiler, connection):
         # PostgreSQL method
-        sql, params = self.as_sql(compiler, connection, template='%(function)s(%(expressions))')
-        print(sql)
-        print(params)
-        return sql, params
+        return self.as_sql(compiler, connection, template='%(function)s(%(expressions)s)')
+
+
+# Lookups on dynamic columns that filter() can apply to Cell before pivoting
+PUSHDOWN_LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'isnull', 'startswith')
+
+
+# Lookups on the row id that filter() applies to Cell.primary_key
+ROW_KEY_LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte')
+
+
+# Cell field holding the typed copy of the value, by Column.data_type
+TYPED_VALUE_FIELDS = {
+    Column.INTEGER: 'int_value',
+    Column.FLOAT: 'num_value',
+    Column.DATE: 'date_value',
+    Column.DATETIME: 'datetime_value',
+}
+
+
+# Column.data_type of the DynamicDBModel fields, by Field.get_internal_type()
+FIELD_DATA_TYPES = {
+    'IntegerField': Column.INTEGER,
+    'BigIntegerField': Column.INTEGER,
+    'SmallIntegerField': Column.INTEGER,
+    'PositiveIntegerField': Column.INTEGER,
+    'PositiveSmallIntegerField': Column.INTEGER,
+    'FloatField': Column.FLOAT,
+    'DecimalField': Column.FLOAT,
+    'DateField': Column.DATE,
+    'DateTimeField': Column.DATETIME,
+}
+
+
+def to_typed_value(data_type, val):
+    """
+    Convert val to the Python type stored in the typed field of data_type.
+    Strings, as received by the REST views, are parsed.
+    """
+    if val is None or val == '':
+        return None
+    if data_type == Column.INTEGER:
+        try:
+            return int(val)
+        except ValueError:
+            # '2.0'
+            return int(float(val))
+    if data_type == Column.FLOAT:
+        return float(val)
+    if data_type == Column.DATE:
+        if isinstance(val, datetime.datetime):
+            return val.date()
+        if isinstance(val, datetime.date):
+            return val
+        return parse_date(str(val))
+    if data_type == Column.DATETIME:
+        if not isinstance(val, datetime.datetime):
+            val = parse_datetime(str(val))
+        if val is not None and settings.USE_TZ and timezone.is_naive(val):
+            val = timezone.make_aware(val)
+        return val
+    return str(val)
+
+
+def get_cell_values(data_type, val):
+    """
+    Return the Cell field values storing val in a column of data_type.
+    """
+    values = {
+        'value': None if val is None else str(val),
+        'int_value': None, 'num_value': None, 'date_value': None, 'datetime_value': None,
+    }
+    if data_type in TYPED_VALUE_FIELDS:
+        values[TYPED_VALUE_FIELDS[data_type]] = to_typed_value(data_type, val)
+    return values
+
+
+def convert_cells(column, data_type, chunk_size=400):
+    """
+    Rewrite the typed values of the cells of column for data_type, parsed
+    from their value as the writes do, in chunks of cell ids: one UPDATE
+    with a CASE per chunk. A value that does not parse is kept in value
+    only. Must run inside a transaction, with the change of
+    column.data_type.
+    """
+    cells = Cell.objects.filter(table_id=column.table_id, value_type_id=column.pk)
+    cells.update(int_value=None, num_value=None, date_value=None, datetime_value=None)
+    field = TYPED_VALUE_FIELDS.get(data_type)
+    if field is None:
+        return
+    output_field = Cell._meta.get_field(field)
+    cells = cells.filter(value__isnull=False)
+    bounds = cells.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        chunk = cells.filter(pk__gte=start, pk__lt=start + chunk_size)
+        whens = []
+        for pk, value in chunk.values_list('pk', 'value'):
+            try:
+                typed = to_typed_value(data_type, value)
+            except (TypeError, ValueError):
+                typed = None
+            if typed is not None:
+                whens.append(When(pk=pk, then=Value(typed, output_field=output_field)))
+        if whens:
+            chunk.update(**{field: Case(*whens, default=None, output_field=output_field)})
+
+
+def make_cell(table_id, row_id, column_id, data_type, val):
+    return Cell(table_id=table_id, primary_key_id=row_id, value_type_id=column_id, **get_cell_values(data_type, val))
+
+
+class PivotCompiler(object):
+    """
+    Build the aggregates selecting the value of each column in the pivot
+    GROUP BY: MAX(CASE WHEN value_type_id = X THEN value END).
+    Subclasses registered in PIVOT_COMPILERS override pivot_value() for a
+    database vendor.
+    relation is the name the Cell fields are read through when the pivot
+    is grouped from Row, None when it is grouped from Cell.
+    """
+
+    def get_annotation(self, column_id, data_type, relation=None):
+        # Typed columns are read from their typed field so that filters,
+        # ordering and aggregates run on native numbers and dates.
+        return self.pivot_value(TYPED_VALUE_FIELDS.get(data_type, 'value'), column_id, relation)
+
+    def pivot_value(self, field, column_id, relation=None):
+        return Max(Case(When(**{
+            get_cell_lookup('value_type_id', relation): column_id,
+            'then': F(get_cell_lookup(field, relation)),
+        })))
+
+
+class PostgreSQLPivotCompiler(PivotCompiler):
+    """
+    MAX(value) FILTER (WHERE value_type_id = X): the filter is applied by the
+    aggregate, without evaluating a CASE per cell.
+    """
+
+    def pivot_value(self, field, column_id, relation=None):
+        return Max(get_cell_lookup(field, relation), filter=Q(**{get_cell_lookup('value_type_id', relation): column_id}))
+
+
+class SQLitePivotCompiler(PivotCompiler):
+    """
+    GROUP_CONCAT(CASE ...) for text values: SQLite does not truncate it and
+    runs it faster than MAX() on strings (see benchmarks/pivot.py).
+    """
+
+    def pivot_value(self, field, column_id, relation=None):
+        if field != 'value':
+            return super(SQLitePivotCompiler, self).pivot_value(field, column_id, relation)
+        return Concat(Case(When(**{
+            get_cell_lookup('value_type_id', relation): column_id,
+            'then': F(get_cell_lookup(field, relation)),
+        })))
+
+
+def get_cell_lookup(field, relation=None):
+    return field if relation is None else relation + '__' + field
+
+
+# PivotCompiler by connection.vendor, PivotCompiler otherwise
+PIVOT_COMPILERS = {
+    'postgresql': PostgreSQLPivotCompiler,
+    'sqlite': SQLitePivotCompiler,
+}
+
+
+def get_pivot_compiler(vendor=None):
+    return PIVOT_COMPILERS.get(vendor or connection.vendor, PivotCompiler)()
+
+
+def get_pivot_annotation(column_id, data_type):
+    """
+    Aggregate selecting the value of one column in the pivot GROUP BY.
+    """
+    return get_pivot_compiler().get_annotation(column_id, data_type)
+
+
+# Cell fields holding the value, see get_cell_values()
+VALUE_FIELDS = ('value', 'int_value', 'num_value', 'date_value', 'datetime_value')
+
+# Cell fields written by upsert_cells()
+UPSERT_FIELDS = ('table', 'primary_key', 'value_type') + VALUE_FIELDS
+
+
+def upsert_cells(cells, batch_size=300):
+    """
+    Insert the given Cells or update the value of the existing ones, relying
+    on the unique (primary_key, value_type) constraint.
+    INSERT ... ON CONFLICT on PostgreSQL and SQLite >= 3.24,
+    INSERT ... ON DUPLICATE KEY UPDATE on MySQL, delete + insert elsewhere.
+    """
+    if not cells:
+        return
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        import sqlite3
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            vendor = None
+    if vendor not in ('postgresql', 'sqlite', 'mysql'):
+        rows = set(cell.primary_key_id for cell in cells)
+        columns = set(cell.value_type_id for cell in cells)
+        stale = Cell.objects.filter(primary_key_id__in=rows, value_type_id__in=columns)
+        stale._raw_delete(stale.db)
+        Cell.objects.bulk_create(cells, batch_size=batch_size)
+        return
+
+    qn = connection.ops.quote_name
+    fields = [Cell._meta.get_field(name) for name in UPSERT_FIELDS]
+    update_fields = [field for field in fields if field.name in VALUE_FIELDS]
+    if vendor == 'mysql':
+        conflict = ' ON DUPLICATE KEY UPDATE %s' % ', '.join(
+            '%s = VALUES(%s)' % (qn(field.column), qn(field.column)) for field in update_fields
+        )
+    else:
+        keys = ['primary_key_id', 'value_type_id']
+        if partitions.is_partitioned():
+            # The unique index of a partitioned Cell includes table_id, with
+            # or without the setting
+            keys.insert(0, 'table_id')
+        conflict = ' ON CONFLICT (%s) DO UPDATE SET %s' % (
+            ', '.join(qn(key) for key in keys),
+            ', '.join('%s = EXCLUDED.%s' % (qn(field.column), qn(field.column)) for field in update_fields),
+        )
+    placeholder = '(%s)' % ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        for start in range(0, len(cells), batch_size):
+            batch = cells[start:start + batch_size]
+            params = []
+            for cell in batch:
+                params.extend(field.get_db_prep_save(getattr(cell, field.attname), connection) for field in fields)
+            cursor.execute('INSERT INTO %s (%s) VALUES %s%s' % (
+                qn(Cell._meta.db_table),
+                ', '.join(qn(field.column) for field in fields),
+                ', '.join([placeholder] * len(batch)),
+                conflict,
+            ), params)
 
 
 # From https://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-snake-case
@@ -81,13 +362,553 @@ def convert(name):
     return all_cap_re.sub(r'\1_\2', s1).lower()
 
 
+class TableSchema(object):
+    """
+    Cached description of a dynamic table: its columns and the pivot
+    annotations built from them.
+    """
+
+    def __init__(self, table_id, table_name, columns, version=None, materialized=False):
+        self.table_id = table_id
+        self.table_name = table_name
+        self.version = version
+        self.materialized = materialized
+        # column id -> column name, in creation order
+        self.columns = OrderedDict((col['id'], col['name']) for col in columns)
+        # column name -> column id
+        self.column_ids = OrderedDict((name, pk) for pk, name in self.columns.items())
+        # column name -> Column.data_type
+        self.data_types = dict((col['name'], col.get('data_type', Column.TEXT)) for col in columns)
+        self.annotations = OrderedDict(
+            (name, get_pivot_annotation(pk, self.data_types[name]))
+            for pk, name in self.columns.items()
+        )
+
+
+def get_commit_keys():
+    """
+    Return the keys of the callbacks of on_commit_once() registered by the
+    transaction in progress: those of the savepoints rolled back are gone.
+    """
+    if not connection.in_atomic_block:
+        return set()
+    return set(getattr(entry[1], 'key', None) for entry in connection.run_on_commit)
+
+
+def on_commit_once(key, func):
+    """
+    Call func when the transaction in progress commits, once per key and
+    transaction, or now outside of a transaction.
+    """
+    if connection.in_atomic_block:
+        if key in get_commit_keys():
+            return
+        func = partial(func)
+        func.key = key
+    transaction.on_commit(func)
+
+
+class PendingTables(threading.local):
+    """
+    Tables changed by the transaction in progress in the current thread.
+
+    The caches shared with the other threads and processes are invalidated
+    when the transaction commits: until then they hold the committed state,
+    which the transaction itself must not read. by_id and by_name hold its
+    own entries for these tables.
+
+    A table is pending as long as the commit callback registered with it,
+    by its key, is: a rollback of the transaction, or of the savepoint that
+    registered it, drops it. An own entry is dropped when the savepoint it
+    was loaded in ends: it may have been rolled back.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # commit callback key -> (table id, table name) pairs
+        self.keys = {}
+        self.table_ids = set()
+        self.table_names = set()
+        self.by_id = {}
+        self.by_name = {}
+        # table id -> savepoint ids when its entry was loaded
+        self.loaded_in = {}
+
+    def is_active(self):
+        if not self.keys:
+            return False
+        registered = get_commit_keys()
+        expired = [key for key in self.keys if key not in registered]
+        savepoint_ids = tuple(connection.savepoint_ids)
+        for table_id, loaded_in in list(self.loaded_in.items()):
+            if expired or savepoint_ids[:len(loaded_in)] != loaded_in:
+                self.discard_entries(table_id)
+        if expired:
+            for key in expired:
+                del self.keys[key]
+            tables = set(chain.from_iterable(self.keys.values()))
+            self.table_ids = set(table_id for table_id, table_name in tables if table_id is not None)
+            self.table_names = set(table_name for table_id, table_name in tables if table_name is not None)
+        return bool(self.keys)
+
+    def add(self, key, table_id=None, table_name=None):
+        """
+        Mark a table pending until the commit callback registered under key
+        runs or is rolled back.
+        """
+        # Also drops the entries the transaction loaded
+        self.discard(table_id, table_name)
+        self.keys.setdefault(key, set()).add((table_id, table_name))
+        if table_id is not None:
+            self.table_ids.add(table_id)
+        if table_name is not None:
+            self.table_names.add(table_name)
+
+    def discard(self, table_id=None, table_name=None):
+        self.table_ids.discard(table_id)
+        self.table_names.discard(table_name)
+        self.discard_entries(table_id, table_name)
+
+    def store(self, schema):
+        self.by_id[schema.table_id] = schema
+        self.by_name[schema.table_name] = schema
+        self.loaded_in[schema.table_id] = tuple(connection.savepoint_ids)
+
+    def discard_entries(self, table_id=None, table_name=None):
+        for schema in (self.by_id.pop(table_id, None), self.by_name.pop(table_name, None)):
+            if schema is not None:
+                self.by_id.pop(schema.table_id, None)
+                self.by_name.pop(schema.table_name, None)
+                self.loaded_in.pop(schema.table_id, None)
+
+    def __contains__(self, table_id):
+        return self.is_active() and table_id in self.table_ids
+
+
+class SchemaRegistry(object):
+    """
+    Process-local registry of TableSchema keyed by table name and table id.
+
+    Entries are dropped by the post_save/post_delete receivers of Table and
+    Column (see signals.py) when the transaction commits. When
+    DYNAMIC_DATABASE_SCHEMA_CACHE names a cache alias, every invalidation
+    also bumps a version stamp in that cache so the other worker processes
+    reload their stale entries.
+    """
+
+    version_key = 'django_dynamic_database:schema:%s'
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_name = {}
+        self._lock = threading.RLock()
+        self._pending = PendingTables()
+
+    def _get_cache(self):
+        alias = getattr(settings, 'DYNAMIC_DATABASE_SCHEMA_CACHE', None)
+        if alias is None:
+            return None
+        return caches[alias]
+
+    def _get_version(self, table_id):
+        cache = self._get_cache()
+        if cache is None:
+            return None
+        return cache.get(self.version_key % table_id, 0)
+
+    def _bump_version(self, table_id):
+        cache = self._get_cache()
+        if cache is None:
+            return
+        key = self.version_key % table_id
+        cache.add(key, 0)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, 1)
+
+    def _get_entries(self, table_name=None, table_id=None):
+        # (by id, by name) dicts holding the schema of the table
+        pending = self._pending
+        if pending.is_active() and (table_id in pending.table_ids or table_name in pending.table_names):
+            return pending.by_id, pending.by_name
+        return self._by_id, self._by_name
+
+    def _load(self, table_name=None, table_id=None):
+        try:
+            if table_id is not None:
+                table = Table.objects.get(pk=table_id)
+            else:
+                table = Table.objects.get(name=table_name)
+        except ObjectDoesNotExist:
+            return None
+        columns = table.columns.order_by('id').values('id', 'name', 'data_type')
+        schema = TableSchema(table.pk, table.name, columns, self._get_version(table.pk), table.materialized)
+        by_id, by_name = self._get_entries(schema.table_name, schema.table_id)
+        if by_id is self._pending.by_id:
+            self._pending.store(schema)
+            return schema
+        with self._lock:
+            by_id[schema.table_id] = schema
+            by_name[schema.table_name] = schema
+        return schema
+
+    def get(self, table_name=None, table_id=None):
+        """
+        Return the TableSchema of a table, loading it on a miss.
+        Return None if the table does not exist.
+        """
+        by_id, by_name = self._get_entries(table_name, table_id)
+        if table_id is not None:
+            schema = by_id.get(table_id)
+        else:
+            schema = by_name.get(table_name)
+        if schema is not None and schema.version != self._get_version(schema.table_id):
+            self._drop(table_id=schema.table_id)
+            schema = None
+        if schema is None:
+            schema = self._load(table_name, table_id)
+        return schema
+
+    def _drop(self, table_id=None, table_name=None):
+        # Drop the entries of this process, return the ids of their tables
+        with self._lock:
+            stale = [self._by_id.pop(table_id, None), self._by_name.pop(table_name, None)]
+            table_ids = set([table_id]) if table_id is not None else set()
+            for schema in stale:
+                if schema is not None:
+                    table_ids.add(schema.table_id)
+                    self._by_id.pop(schema.table_id, None)
+                    if self._by_name.get(schema.table_name) is schema:
+                        del self._by_name[schema.table_name]
+        return table_ids
+
+    def invalidate(self, table_id=None, table_name=None, broadcast=True):
+        """
+        Drop the schema of a table when the transaction in progress commits.
+        The transaction reads its own entry in the meantime.
+        """
+        key = ('schema', table_id, table_name)
+        if connection.in_atomic_block:
+            pending = self._pending
+            pending.is_active()
+            # The former name of a renamed table
+            for schema in (self._by_id.get(table_id), pending.by_id.get(table_id)):
+                if schema is not None:
+                    pending.add(key, table_name=schema.table_name)
+            pending.add(key, table_id, table_name)
+        on_commit_once(key, partial(self._commit, table_id, table_name, broadcast))
+
+    def _commit(self, table_id, table_name, broadcast):
+        self._pending.discard(table_id, table_name)
+        table_ids = self._drop(table_id, table_name)
+        if broadcast:
+            for pk in table_ids:
+                self._bump_version(pk)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._by_name.clear()
+            self._pending.reset()
+
+
+schema_registry = SchemaRegistry()
+
+
+class ResultCache(object):
+    """
+    Opt-in cache of the results of dynamic querysets, in the cache alias
+    named by DYNAMIC_DATABASE_RESULT_CACHE.
+
+    Keys combine the SQL and parameters of the queryset with a version
+    counter of its table, bumped when a write through the post_rows_save
+    and pre_rows_delete signals (see receivers.py) commits: the results
+    cached before a write are no longer reached and expire after
+    DYNAMIC_DATABASE_RESULT_CACHE_TIMEOUT seconds. Results of more than
+    DYNAMIC_DATABASE_RESULT_CACHE_MAX_ROWS rows are not cached.
+
+    Rows are stored as tuples, with the column names once per result.
+    hits, misses and invalidations count the calls of this process.
+    """
+
+    version_key = 'django_dynamic_database:rows:%s'
+    result_key = 'django_dynamic_database:result:%s:%s:%s'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = PendingTables()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _get_cache(self):
+        alias = getattr(settings, 'DYNAMIC_DATABASE_RESULT_CACHE', None)
+        if alias is None:
+            return None
+        return caches[alias]
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_version(self, table_id):
+        cache = self._get_cache()
+        key = self.version_key % table_id
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, 0, None)
+            version = cache.get(key, 0)
+        return version
+
+    def invalidate(self, table_id):
+        """
+        Bump the version of a table when the transaction in progress
+        commits. The transaction reads the table without the cache in the
+        meantime.
+        """
+        if self._get_cache() is None:
+            return
+        key = ('rows', table_id)
+        if connection.in_atomic_block:
+            self._pending.is_active()
+            self._pending.add(key, table_id)
+        on_commit_once(key, partial(self._commit, table_id))
+
+    def _commit(self, table_id):
+        self._pending.discard(table_id)
+        cache = self._get_cache()
+        if cache is None:
+            return
+        key = self.version_key % table_id
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, 1, None)
+        self._count('invalidations')
+
+    def get_rows(self, table_id, queryset):
+        """
+        Return the rows of queryset as a list, from the cache when they were
+        cached since the last write to the table.
+        """
+        cache = self._get_cache()
+        if cache is None or table_id in self._pending:
+            return list(queryset)
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return []
+        digest = hashlib.md5(('%s|%r|%s' % (sql, params, queryset.db)).encode('utf-8')).hexdigest()
+        key = self.result_key % (table_id, self.get_version(table_id), digest)
+        cached = cache.get(key)
+        if cached is not None:
+            self._count('hits')
+            return self._unpack(cached)
+        self._count('misses')
+        rows = list(queryset)
+        if len(rows) <= getattr(settings, 'DYNAMIC_DATABASE_RESULT_CACHE_MAX_ROWS', 1000):
+            cache.set(key, self._pack(rows), getattr(settings, 'DYNAMIC_DATABASE_RESULT_CACHE_TIMEOUT', 300))
+        return rows
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
+
+    def _pack(self, rows):
+        # (column names, value tuples) for dicts, (None, rows) otherwise
+        if rows and isinstance(rows[0], dict):
+            names = tuple(rows[0])
+            return names, [tuple(row[name] for name in names) for row in rows]
+        return None, [tuple(row) if isinstance(row, list) else row for row in rows]
+
+    def _unpack(self, cached):
+        names, rows = cached
+        if names is None:
+            return list(rows)
+        return [dict(zip(names, row)) for row in rows]
+
+
+result_cache = ResultCache()
+
+
+def touch_table(table_id):
+    """
+    Bump the change stamp of a table, Table.version and Table.modified, once
+    when the transaction in progress commits: the writers of a table do not
+    wait for each other on its row.
+    """
+    on_commit_once(('stamp', table_id), partial(_touch_table, table_id))
+
+
+def _touch_table(table_id):
+    Table.objects.filter(pk=table_id).update(version=F('version') + 1, modified=timezone.now())
+
+
+def can_return_row_ids():
+    features = connection.features
+    return getattr(features, 'can_return_ids_from_bulk_insert', getattr(features, 'can_return_rows_from_bulk_insert', False))
+
+
+def lock_rows(table_id):
+    """
+    Keep the other transactions from inserting Rows in table_id until the
+    end of the transaction in progress, where the ids of a bulk insert are
+    read back as the last ids of the table (see bulk_create_rows()). Every
+    insert of Rows takes this lock. SQLite serializes the writers anyway.
+    """
+    if connection.features.has_select_for_update and not can_return_row_ids():
+        list(Table.objects.select_for_update().filter(pk=table_id).values_list('pk'))
+
+
+def create_row(table_id):
+    """
+    Insert one Row in table_id and return its id. Must run inside a
+    transaction.
+    """
+    lock_rows(table_id)
+    return Row.objects.create(table_id=table_id).pk
+
+
+def bulk_create_rows(table_id, count, batch_size=None):
+    """
+    Insert count Rows in table_id and return their ids in insertion order.
+    Must run inside a transaction.
+    """
+    rows = [Row(table_id=table_id) for i in range(count)]
+    if can_return_row_ids():
+        # PostgreSQL: ids come back from INSERT ... RETURNING
+        Row.objects.bulk_create(rows, batch_size=batch_size)
+        return [row.pk for row in rows]
+    # No other transaction inserts rows in the table before ours commits:
+    # ours are the last ones.
+    lock_rows(table_id)
+    Row.objects.bulk_create(rows, batch_size=batch_size)
+    row_ids = list(Row.objects.filter(table_id=table_id).order_by('-pk').values_list('pk', flat=True)[:count])
+    row_ids.reverse()
+    return row_ids
+
+
+# Temporary table of the ids of the rows written by a set-based update or
+# delete, one per nesting level
+ROW_IDS_TABLE = 'ddb_row_ids_%d'
+
+_staged = threading.local()
+
+
+class StagedRowIds(RawSQL):
+    """
+    Subquery of the staged row ids, for __in lookups only, which wrap it in
+    parentheses themselves: RawSQL would add a second pair, which SQLite
+    reads as a list of one value.
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+@contextmanager
+def staged_row_ids(queryset):
+    """
+    Copy the ids of the rows of a pivot queryset into a temporary table, in
+    one INSERT ... SELECT, and yield their number and a subquery of them.
+    The statements that follow select the same rows once the cells change,
+    and the ids never go through Python. Must run inside a transaction: the
+    ids are left in the table on error and rolled back with it.
+    """
+    qn = connection.ops.quote_name
+    depth = getattr(_staged, 'depth', 0)
+    table = qn(ROW_IDS_TABLE % depth)
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE IF NOT EXISTS %s (id bigint PRIMARY KEY)' % table)
+        try:
+            sql, params = queryset.values('id').order_by().query.get_compiler(connection=connection).as_sql()
+        except EmptyResultSet:
+            count = 0
+        else:
+            cursor.execute('INSERT INTO %s (id) %s' % (table, sql), params)
+            count = cursor.rowcount
+    _staged.depth = depth + 1
+    try:
+        yield count, StagedRowIds('SELECT id FROM %s' % table, ())
+    finally:
+        _staged.depth = depth
+    if count:
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % table)
+
+
+def insert_row(schema, data, sender=Table):
+    """
+    Insert one row in the table of schema with the values of data, in two
+    INSERT statements whatever the number of columns. Columns missing from
+    data are stored as NULL.
+    @return :dict The row, built from the values written
+    """
+    unknown = [attr for attr in data if attr not in schema.column_ids]
+    if unknown:
+        raise ValueError('Unknown columns: %s.' % ', '.join(sorted(unknown)))
+    row = OrderedDict()
+    cells = []
+    with transaction.atomic():
+        row_id = create_row(schema.table_id)
+        for column_id, name in schema.columns.items():
+            data_type = schema.data_types[name]
+            values = get_cell_values(data_type, data.get(name))
+            cells.append(Cell(table_id=schema.table_id, primary_key_id=row_id, value_type_id=column_id, **values))
+            row[name] = values[TYPED_VALUE_FIELDS.get(data_type, 'value')]
+        Cell.objects.bulk_create(cells)
+        post_rows_save.send(sender=sender, table_id=schema.table_id, row_ids=[row_id])
+    row['id'] = row_id
+    return row
+
+
+def decode_json_row(schema, fields, row_id, data):
+    """
+    Return the row of a JSON object of cell values keyed by column id, as
+    built by JSONObjectAgg, as a dict of the given columns of schema.
+    """
+    if data is None:
+        data = {}
+    elif isinstance(data, str):
+        data = json.loads(data)
+    row = {}
+    for name in fields:
+        data_type = schema.data_types[name]
+        val = data.get(str(schema.column_ids[name]))
+        row[name] = to_typed_value(data_type, val) if data_type in TYPED_VALUE_FIELDS else val
+    row['id'] = row_id
+    return row
+
+
+class JSONRowIterable(BaseIterable):
+    """
+    Decode the (row id, JSON object) pairs of a values_list() into dicts
+    of the given columns of schema, keyed by column name.
+    """
+
+    def __init__(self, queryset, schema, fields, **kwargs):
+        super(JSONRowIterable, self).__init__(queryset, **kwargs)
+        self.schema = schema
+        self.fields = fields
+
+    def __iter__(self):
+        compiler = self.queryset.query.get_compiler(self.queryset.db)
+        for row_id, data in compiler.results_iter(chunked_fetch=self.chunked_fetch, chunk_size=self.chunk_size):
+            yield decode_json_row(self.schema, self.fields, row_id, data)
+
+
 class DynamicDBModelQuerySet(models.QuerySet):
 
     ####################################
     # METHODS THAT DO DATABASE QUERIES #
     ####################################
     
-    def get_queryset(self, ids=None):
+    def get_queryset(self, ids=None, row_filter=None, fields=None):
         
         table_name = convert(self.model.__name__)
         
@@ -98,12 +919,32 @@ class DynamicDBModelQuerySet(models.QuerySet):
     
         column_names = self._get_columns_name()
         
+        schema = self._get_table_schema(table_name)
+
+        if fields is not None:
+            column_names = self._get_pruned_columns(schema, fields)
+        if materialized.is_materialized(schema):
+            # Read the wide table kept by materialized.py: no GROUP BY
+            object_set = materialized.get_pivot_model(schema).objects.values(*(column_names + ['id']))
+            if ids is not None:
+                object_set = object_set.filter(id__in=ids)
+            object_set._fields = None
+            object_set.update = types.MethodType(self.update, object_set) # bound update() method
+            object_set.delete = types.MethodType(self.delete, object_set) # bound delete() method
+            return object_set
+
+        if fields is not None:
+            return self._get_pruned_queryset(schema, column_names, ids, row_filter)
+
         values = self._get_query_values(column_names)
 
+        cell_set = Cell.objects.filter(table_id=schema.table_id)
         if ids is not None:
-            object_set = Cell.objects.filter(primary_key__table__name=table_name, primary_key__id__in=ids).values('primary_key').annotate(**annotations).values(**values).order_by()
-        else:
-            object_set = Cell.objects.filter(primary_key__table__name=table_name).values('primary_key').annotate(**annotations).values(**values).order_by()
+            cell_set = cell_set.filter(primary_key__id__in=ids)
+        if row_filter is not None:
+            # Restrict the cells to aggregate before the GROUP BY
+            cell_set = cell_set.filter(row_filter)
+        object_set = cell_set.values('primary_key').annotate(**annotations).values(**values).order_by()
         
         object_set._fields = None
         
@@ -112,39 +953,227 @@ class DynamicDBModelQuerySet(models.QuerySet):
         return object_set
     
 
+    @instrumented
+    def json_rows(self, *fields, **kwargs):
+        """
+        Read the rows aggregated by the database into one JSON object each,
+        keyed by column id, instead of one pivot expression per column: the
+        SQL does not grow with the number of columns.
+        Only the given fields (all the columns by default) are read, and
+        only the lookups that filter() pushes down to Cell are accepted.
+        @return :QuerySet of dicts, as values() on the pivot
+        """
+        schema = self._get_table_schema()
+        if schema is None:
+            return Cell.objects.none()
+        fields = [name for name in (fields or schema.column_ids) if name not in ('id', 'pk')]
+        unknown = [name for name in fields if name not in schema.column_ids]
+        if unknown:
+            raise FieldError("Cannot resolve keyword %s into field." % ', '.join(repr(name) for name in unknown))
+        if materialized.is_materialized(schema):
+            # The wide table is read as is
+            return self.filter(**kwargs).values(*(fields + ['id']))
+        row_filter, remaining = self._get_pushdown_filter(kwargs)
+        cell_set = Cell.objects.filter(
+            table_id=schema.table_id,
+            value_type_id__in=[schema.column_ids[name] for name in fields],
+        )
+        for key, val in remaining.items():
+            name, sep, lookup = key.partition('__')
+            if name not in ('id', 'pk'):
+                raise FieldError("Lookup %r is not supported by json_rows()." % key)
+            cell_set = cell_set.filter(**{'primary_key_id' + sep + lookup: val})
+        if row_filter is not None:
+            cell_set = cell_set.filter(row_filter)
+        object_set = cell_set.values('primary_key').annotate(
+            data=JSONObjectAgg(Cast('value_type_id', models.CharField()), 'value')
+        ).values_list('primary_key', 'data').order_by()
+        object_set._iterable_class = partial(JSONRowIterable, schema=schema, fields=fields)
+        return object_set
+
+
+    def _get_pruned_queryset(self, schema, column_names, ids=None, row_filter=None):
+        """
+        Pivot the given columns only, grouping the Rows of the table joined
+        to their cells of these columns: the other cells are not scanned and
+        the rows without any of them are kept.
+        row_filter is a Q on 'primary_key' as built by _get_pushdown_filter().
+        """
+        compiler = get_pivot_compiler()
+        annotations = OrderedDict(
+            (name, compiler.get_annotation(schema.column_ids[name], schema.data_types[name], 'pivot_cell'))
+            for name in column_names
+        )
+        row_set = Row.objects.filter(table_id=schema.table_id).annotate(pivot_cell=FilteredRelation(
+            'cell', condition=Q(cell__value_type_id__in=sorted(schema.column_ids[name] for name in column_names)),
+        ))
+        if ids is not None:
+            row_set = row_set.filter(pk__in=ids)
+        if row_filter is not None:
+            row_set = row_set.filter(self._get_row_condition(row_filter))
+        object_set = row_set.values('id').annotate(**annotations).values(*(column_names + ['id'])).order_by()
+        object_set._fields = None
+        object_set.update = types.MethodType(self.update, object_set) # bound update() method
+        object_set.delete = types.MethodType(self.delete, object_set) # bound delete() method
+        return object_set
+
+
+    @instrumented
+    def only(self, *fields):
+        return self.get_queryset(fields=fields)
+
+
+    @instrumented
+    def defer(self, *fields):
+        schema = self._get_table_schema()
+        if schema is None:
+            return self.get_queryset()
+        return self.get_queryset(fields=[
+            name for name in self._get_columns_name()
+            if name in schema.column_ids and name not in fields
+        ])
+
+
+    @instrumented
+    def values(self, *fields, **expressions):
+        if not fields or expressions:
+            return self._get_filtered_queryset().values(*fields, **expressions)
+        return self._get_filtered_queryset(fields).values(*fields)
+
+
+    @instrumented
+    def values_list(self, *fields, flat=False, named=False):
+        if not fields:
+            return self._get_filtered_queryset().values_list(flat=flat, named=named)
+        return self._get_filtered_queryset(fields).values_list(*fields, flat=flat, named=named)
+
+
+    @instrumented
+    def cached(self, queryset=None):
+        """
+        Evaluate queryset, the whole table by default, through the result
+        cache when DYNAMIC_DATABASE_RESULT_CACHE is set.
+        @return :list Rows of queryset
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        schema = self._get_table_schema()
+        if schema is None:
+            return list(queryset)
+        return result_cache.get_rows(schema.table_id, queryset)
+
+
+    @instrumented
+    def count(self):
+        row_set = self._get_row_set()
+        if row_set is None:
+            return self._get_filtered_queryset().count()
+        return row_set.count()
+
+
+    @instrumented
+    def exists(self):
+        row_set = self._get_row_set()
+        if row_set is None:
+            return self._get_filtered_queryset().exists()
+        return row_set.exists()
+
+
+    @instrumented
+    def aggregate(self, *args, **kwargs):
+        return self.get_queryset().aggregate(*args, **kwargs)
+
+
+    def _get_row_set(self):
+        """
+        Return the Rows matched by the filter() this was bound by, or None
+        when some of its lookups can only be applied to the pivot.
+        """
+        schema = self._get_table_schema()
+        if schema is None:
+            return Row.objects.none()
+        row_filter, lookups = getattr(self, '_filter_lookups', (None, {}))
+        if lookups:
+            return None
+        row_set = Row.objects.filter(table_id=schema.table_id)
+        if row_filter is not None:
+            row_set = row_set.filter(self._get_row_condition(row_filter))
+        return row_set
+
+
+    def _get_filtered_queryset(self, fields=None):
+        """
+        Return the pivot of the given columns (all if None) with the lookups
+        of the filter() it was bound by applied.
+        """
+        row_filter, lookups = getattr(self, '_filter_lookups', (None, {}))
+        if fields is not None:
+            # The columns the remaining lookups apply to are pivoted too
+            fields = list(fields) + [key.split('__')[0] for key in lookups if key.split('__')[0] not in fields]
+        return self.get_queryset(row_filter=row_filter, fields=fields).filter(**lookups)
+
+
+    @instrumented
+    def filter(self, *args, **kwargs):
+        row_filter, kwargs = self._get_pushdown_filter(kwargs)
+        res = self.get_queryset(row_filter=row_filter).filter(*args, **kwargs)
+        if not args:
+            # filter().values() pivots the requested columns only, and
+            # count() and exists() skip the pivot when they can
+            self._filter_lookups = (row_filter, kwargs)
+            res.values = self.values
+            res.values_list = self.values_list
+            res.count = self.count
+            res.exists = self.exists
+        return res
+
+
+    @instrumented
+    def exclude(self, *args, **kwargs):
+        row_filter, remaining = self._get_pushdown_filter(kwargs)
+        # exclude(a=1, b=2) is NOT (a=1 AND b=2): it can only be pushed down whole
+        if args or remaining or row_filter is None:
+            return self.get_queryset().exclude(*args, **kwargs)
+        return self.get_queryset(row_filter=~row_filter)
+
+
+    @instrumented
     def get(self, *args, **kwargs):
-        res = self.get_queryset().get(*args, **kwargs)
+        if not args and len(kwargs) == 1 and documents.is_enabled():
+            key, val = list(kwargs.items())[0]
+            schema = self._get_table_schema()
+            if key in ('id', 'pk', 'id__exact', 'pk__exact') and schema is not None:
+                # One Row read instead of the pivot of its cells
+                row = documents.get_row(schema, val)
+                if row is not None:
+                    return self._dict_to_object(row)
+        res = self.filter(*args, **kwargs).get()
         # print(str(res))
         if isinstance(res, dict) and res != {}:
             res = self._dict_to_object(res) # Converting to object
             return res
     
 
+    @instrumented
     def create(self, **kwargs):
         defaults=None
         lookup, params = self._extract_model_params(defaults, **kwargs)
         objs = []
         ids = []
         column_names = self._get_columns_name()
-        table_name = convert(self.model.__name__)
-        table_obj, table_created = Table.objects.get_or_create(name=table_name)
-        # Create column for this new table
-        if table_created:
-            # batch_size = len(column_names) # To use in bulk_create()
-            col_set = []
-            for colname in column_names:
-                col_set.append(Column(table=table_obj, name=colname))
-            Column.objects.bulk_create(col_set)
+        schema = self._get_or_create_table_schema(column_names)
+        table_obj = Table(pk=schema.table_id, name=schema.table_name)
         if table_obj is not None:
-            # Create row to initialize pk
-            row_obj = Row.objects.create(table=table_obj)
-            if row_obj is not None:
+            with transaction.atomic():
+                # Create row to initialize pk
+                row_obj = Row(pk=create_row(schema.table_id), table=table_obj)
                 for attr, val in list(params.items()):
-                    col_obj = Column.objects.get(table=table_obj, name=attr)
-                    objs.append(Cell(primary_key=row_obj, value_type=col_obj, value=str(val)))
+                    objs.append(make_cell(schema.table_id, row_obj.pk, schema.column_ids[attr], schema.data_types[attr], val))
                 Cell.objects.bulk_create(objs)
+                post_rows_save.send(sender=self.model, table_id=schema.table_id, row_ids=[row_obj.pk])
+            if row_obj is not None:
                 # Initialize annotations and values to return query_set from pivot
-                annotations = self._get_custom_annotation()
+                annotations = OrderedDict(schema.annotations)
                 values = self._get_query_values(column_names)
                 try:
                     obj = Cell.objects.values('primary_key').annotate(**annotations).filter(primary_key=row_obj).values(**values).order_by()
@@ -155,10 +1184,36 @@ class DynamicDBModelQuerySet(models.QuerySet):
                     pass
 
 
+    @instrumented
     def bulk_create(self, objs, batch_size=None):
-        pass
-
-
+        """
+        Insert the given model instances without reading the pivot back.
+        The table and its columns are resolved once, the Rows are inserted
+        in one batch and the Cells in chunks of batch_size.
+        """
+        objs = list(objs)
+        if not objs:
+            return objs
+        schema = self._get_or_create_table_schema()
+        fields = [
+            (field.attname if field.attname in schema.column_ids else field.name, field.attname)
+            for field in self.model._meta.concrete_fields
+            if not field.primary_key
+        ]
+        with transaction.atomic():
+            row_ids = bulk_create_rows(schema.table_id, len(objs), batch_size)
+            cells = []
+            for obj, row_id in zip(objs, row_ids):
+                obj.id = row_id
+                for colname, attname in fields:
+                    val = getattr(obj, attname)
+                    cells.append(make_cell(schema.table_id, row_id, schema.column_ids[colname], schema.data_types[colname], val))
+            Cell.objects.bulk_create(cells, batch_size=batch_size)
+            post_rows_save.send(sender=self.model, table_id=schema.table_id, row_ids=row_ids)
+        return objs
+
+
+    @instrumented
     def get_or_create(self, defaults=None, **kwargs):
         lookup, params = self._extract_model_params(defaults, **kwargs)
         try:
@@ -172,6 +1227,7 @@ class DynamicDBModelQuerySet(models.QuerySet):
             return self._create_object_from_params(lookup, params)
 
 
+    @instrumented
     def update_or_create(self, defaults=None, **kwargs):
         defaults = defaults or {}
         lookup, params = self._extract_model_params(defaults, **kwargs)
@@ -189,43 +1245,63 @@ class DynamicDBModelQuerySet(models.QuerySet):
                 return obj, created
 
 
+    @instrumented
     def save(self, obj):
         try:
-            params = obj.__dict__
-            params.pop('save', None)
-            params.pop('delete', None)
+            if isinstance(obj, DynamicRow):
+                params = obj._asdict()
+            else:
+                params = obj.__dict__
+                params.pop('save', None)
+                params.pop('delete', None)
             pars = {k: v() if callable(v) else v for k, v in params.items()}
-            self._save(**pars)
+            obj.id = self._save(**pars)
         except ValueError as e:
             raise(e)
 
 
     def _save(self, **kwargs):
+        """
+        Write all the attributes of one entity in a constant number of
+        queries: the columns are resolved at once and the cells upserted
+        in one statement.
+        @return :int Row id
+        """
+        obj_id = kwargs.pop('id', None)
         
         defaults = {}
         lookup, params = self._extract_model_params(defaults, **kwargs)
         
-        table_name = convert(self.model.__name__)
-        column_names = self._get_columns_name()
-        
-        obj_id = kwargs.pop('id', None)
+        schema = self._get_or_create_table_schema()
         
-        table_obj = Table.objects.get(name=table_name)
+        # Columns added to the model after the table was created
+        missing = [attr for attr in params if attr not in schema.column_ids]
+        if missing:
+            data_types = self._get_columns_data_type()
+            Column.objects.bulk_create([
+                Column(table_id=schema.table_id, name=attr, data_type=data_types.get(attr, Column.TEXT))
+                for attr in missing
+            ])
+            schema_registry.invalidate(table_id=schema.table_id)
+            schema = self._get_table_schema()
+            if schema.materialized:
+                materialized.sync_columns_on_commit(schema.table_id)
         
-        # Check if it is new row
-        if obj_id is None:
-            row_obj = Row.objects.create(table=table_obj)
-        else:
-            row_obj = Row.objects.get(pk=obj_id, table=table_obj)
-        
-        # To-Do: Improve with bulk_update
-        for attr, val in list(params.items()):
-            col_obj, col_created = Column.objects.get_or_create(table=table_obj, name=attr)
-            cell_obj, cell_created = Cell.objects.get_or_create(primary_key=row_obj, value_type=col_obj)
-            cell_obj.value = str(val)
-            cell_obj.save()
-
-
+        with transaction.atomic():
+            # Check if it is new row
+            if obj_id is None:
+                obj_id = create_row(schema.table_id)
+            elif not Row.objects.filter(pk=obj_id, table_id=schema.table_id).exists():
+                raise Row.DoesNotExist("Row matching query does not exist.")
+            upsert_cells([
+                make_cell(schema.table_id, obj_id, schema.column_ids[attr], schema.data_types[attr], val)
+                for attr, val in params.items()
+            ])
+            post_rows_save.send(sender=self.model, table_id=schema.table_id, row_ids=[obj_id])
+        return obj_id
+
+
+    @instrumented
     def delete(self, queryset_or_obj):
 
         assert self.query.can_filter(), \
@@ -236,18 +1312,9 @@ class DynamicDBModelQuerySet(models.QuerySet):
 
         try:
             if queryset_or_obj.__class__.__name__ == "QuerySet":
-                row_ids = []
-                for c in queryset_or_obj:
-                    c = self._dict_to_object(c)
-                    row_ids.append(c.id)
-                row_ids = list(set(row_ids))
-                num = len(row_ids)
-                cell_objs = Cell.objects.filter(primary_key__id__in=row_ids)
-                if cell_objs.exists():
-                    # Raw delete with the convenience of using Django QuerySet
-                   cell_objs._raw_delete(cell_objs.db)
-                   return (num, {'webapp.Entry': num})
-                raise TypeError("System error. QuerySet deletion failed.")
+                return self._delete_queryset(queryset_or_obj)
+            elif isinstance(queryset_or_obj, DynamicRow):
+                return self._delete_object(**queryset_or_obj._asdict())
             else:
                 params = queryset_or_obj.__dict__
                 params.pop('save', None)
@@ -258,45 +1325,120 @@ class DynamicDBModelQuerySet(models.QuerySet):
             raise(e)
 
 
-    def _delete_object(self, **kwargs):
-        
-        defaults = {}
-        lookup, params = self._extract_model_params(defaults, **kwargs)
-        
-        table_name = convert(self.model.__name__)
-        table_obj = Table.objects.get(name=table_name)
-        
-        cell_set = []
-        # To-Do: Improve with bulk_update
-        for attr, val in list(params.items()):
-            col_obj, col_created = Column.objects.get_or_create(table=table_obj, name=attr)
-            cell_objs = Cell.objects.filter(value_type=col_obj, value=val)
-            for c in cell_objs:
-                cell_set.append(c.primary_key.pk)
-        cell_set = list(set(cell_set))
-        num = len(cell_set)
-        cell_objs = Cell.objects.filter(primary_key__id__in=cell_set)
-        if cell_objs.exists():
+    def _delete_queryset(self, queryset):
+        """
+        Delete the rows of a pivot queryset and their cells. The row ids are
+        staged before the cells are deleted: the Rows deleted are exactly the
+        selected ones.
+        """
+        schema = self._get_table_schema()
+        label = __package__ + '.' + self.model.__name__
+        if schema is None:
+            return 0, {label: 0}
+        with transaction.atomic(), staged_row_ids(queryset) as (count, row_ids):
+            if not count:
+                return 0, {label: 0}
+            pre_rows_delete.send(
+                sender=self.model, table_id=schema.table_id,
+                row_ids=Row.objects.filter(pk__in=row_ids).values_list('pk', flat=True),
+            )
+            cell_objs = Cell.objects.filter(table_id=schema.table_id, primary_key_id__in=row_ids)
             # Raw delete with the convenience of using Django QuerySet
             cell_objs._raw_delete(cell_objs.db)
-            return num, {__package__ + '.' + self.model.__name__: num}
-        else:
-            return 0, {__package__ + '.' + self.model.__name__: 0}
+            row_objs = Row.objects.filter(table_id=schema.table_id, pk__in=row_ids)
+            num = row_objs._raw_delete(row_objs.db)
+        return num, {label: num}
 
 
+    def _delete_object(self, **kwargs):
+        """
+        Delete one entity. With its id, the cells and the Row are deleted
+        in two statements; without, the rows matching all of its values are
+        deleted through a filter() pushed down to the cells.
+        """
+        obj_id = kwargs.pop('id', None)
+        schema = self._get_table_schema()
+        label = __package__ + '.' + self.model.__name__
+        if schema is None:
+            return 0, {label: 0}
+        if obj_id is None:
+            lookup = {attr: val for attr, val in kwargs.items() if attr in schema.column_ids and attr not in ('id', 'pk')}
+            if not lookup:
+                return 0, {label: 0}
+            return self._delete_queryset(self.filter(**lookup))
+        with transaction.atomic():
+            pre_rows_delete.send(sender=self.model, table_id=schema.table_id, row_ids=[obj_id])
+            cell_objs = Cell.objects.filter(table_id=schema.table_id, primary_key_id=obj_id)
+            cell_objs._raw_delete(cell_objs.db)
+            row_objs = Row.objects.filter(pk=obj_id, table_id=schema.table_id)
+            num = row_objs._raw_delete(row_objs.db)
+        return num, {label: num}
+
+
+    @instrumented
     def update(self, queryset, **kwargs):
+        """
+        Write kwargs into the cells of the rows of queryset in a single
+        UPDATE, with one CASE on value_type per value field, then insert
+        the cells the rows did not have.
+        @return :int Number of rows matched
+        """
         assert queryset.query.can_filter(), \
             "Cannot update a query once a slice has been taken."
-        table_name = convert(self.model.__name__)
-        table_obj = Table.objects.get(name=table_name)
-        row_ids = []
-        for c in queryset:
-            c = self._dict_to_object(c)
-            row_ids.append(c.id)
-        row_ids = list(set(row_ids))
-        for attr, val in kwargs.items():
-            qs = Cell.objects.filter(primary_key__id__in=row_ids, value_type=Column.objects.get(table=table_obj, name=attr)).update(value=val)
-        return self.get_queryset(ids=row_ids)
+        schema = self._get_table_schema()
+        if schema is None or not kwargs:
+            return 0
+        cell_values = {
+            schema.column_ids[attr]: get_cell_values(schema.data_types[attr], val)
+            for attr, val in kwargs.items()
+        }
+        updates = {}
+        for field in VALUE_FIELDS:
+            output_field = Cell._meta.get_field(field)
+            updates[field] = Case(
+                *[When(value_type_id=column_id, then=Value(values[field], output_field=output_field))
+                  for column_id, values in cell_values.items()],
+                default=F(field), output_field=output_field
+            )
+        with transaction.atomic(), staged_row_ids(queryset) as (count, row_ids):
+            if not count:
+                return 0
+            Cell.objects.filter(
+                table_id=schema.table_id, primary_key_id__in=row_ids, value_type_id__in=list(cell_values)
+            ).update(**updates)
+            self._insert_missing_cells(schema, row_ids, cell_values)
+            post_rows_save.send(
+                sender=self.model, table_id=schema.table_id,
+                row_ids=Row.objects.filter(pk__in=row_ids).values_list('pk', flat=True),
+            )
+        return count
+
+
+    def _insert_missing_cells(self, schema, row_ids, cell_values):
+        """
+        Insert the cells of cell_values, Cell values by column id, that the
+        staged rows row_ids do not have yet: one INSERT ... SELECT per
+        column. A NULL value needs no cell.
+        """
+        qn = connection.ops.quote_name
+        fields = [Cell._meta.get_field(name) for name in UPSERT_FIELDS]
+        cell_table = qn(Cell._meta.db_table)
+        for column_id, values in cell_values.items():
+            if all(val is None for val in values.values()):
+                continue
+            params = [schema.table_id, column_id] + [
+                field.get_db_prep_save(values[field.name], connection) for field in fields[3:]
+            ]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO %s (%s) SELECT %%s, staged.id, %%s, %s FROM (%s) staged '
+                    'WHERE NOT EXISTS (SELECT 1 FROM %s WHERE %s = %%s AND %s = staged.id AND %s = %%s)' % (
+                        cell_table, ', '.join(qn(field.column) for field in fields),
+                        ', '.join(['%s'] * (len(fields) - 3)), row_ids.sql, cell_table,
+                        qn(fields[0].column), qn(fields[1].column), qn(fields[2].column),
+                    ),
+                    params + list(row_ids.params) + [schema.table_id, column_id],
+                )
 
 
     def _create_object_from_params(self, lookup, params):
@@ -325,6 +1467,27 @@ class DynamicDBModelQuerySet(models.QuerySet):
     # CUSTOM PRIVATE METHODS #
     ##########################
 
+    def _extract_model_params(self, defaults, **kwargs):
+        """
+        Return the lookup of get() and the params of create() for kwargs.
+        QuerySet._extract_model_params() returns the params alone from
+        Django 2.2.
+        """
+        lookup = kwargs.copy()
+        for field in self.model._meta.fields:
+            if field.attname in lookup:
+                lookup[field.name] = lookup.pop(field.attname)
+        params = {k: v for k, v in kwargs.items() if LOOKUP_SEP not in k}
+        params.update(defaults or {})
+        names = set(chain.from_iterable((field.name, field.attname) for field in self.model._meta.concrete_fields))
+        invalid = sorted(param for param in params if param not in names)
+        if invalid:
+            raise FieldError("Invalid field name(s) for model %s: '%s'." % (
+                self.model._meta.object_name, "', '".join(invalid),
+            ))
+        return lookup, params
+
+
     def _get_columns_name(self):
         # table = Table.objects.get(name=type(self).__name__)
         # return [col.name for col in Column.filter(table=table)]
@@ -338,21 +1501,129 @@ class DynamicDBModelQuerySet(models.QuerySet):
         return cols
 
 
-    def _get_custom_annotation(self, table_name=None):
+    def _get_columns_data_type(self):
+        # Column.data_type declared by the model fields
+        return {
+            field.name: FIELD_DATA_TYPES.get(field.get_internal_type(), Column.TEXT)
+            for field in self.model._meta.concrete_fields
+            if not field.primary_key and not field.is_relation
+        }
+
 
+    def _get_table_schema(self, table_name=None):
         if table_name is None:
             table_name = convert(self.model.__name__)
-        
-        # columns = Table.objects.get(name=type(self).__name__).columns.values('id','name')
-        # OR
-        try:
-            columns = Table.objects.get(name=table_name).columns.all().values('id','name')
-            return {
-                col["name"]:Concat(Case(When(value_type__id=col["id"], then=F('value'))))
-                for col in columns
-            }
-        except ObjectDoesNotExist:
+        return schema_registry.get(table_name=table_name)
+
+
+    def _get_or_create_table_schema(self, column_names=None):
+        """
+        Return the TableSchema of the model, creating its Table and Columns
+        on first use.
+        """
+        table_name = convert(self.model.__name__)
+        schema = schema_registry.get(table_name=table_name)
+        if schema is not None:
+            return schema
+        if column_names is None:
+            column_names = self._get_columns_name()
+        table_obj, table_created = Table.objects.get_or_create(name=table_name)
+        # Create column for this new table
+        if table_created:
+            data_types = self._get_columns_data_type()
+            Column.objects.bulk_create([
+                Column(table=table_obj, name=colname, data_type=data_types.get(colname, Column.TEXT))
+                for colname in column_names
+            ])
+            # bulk_create() does not send post_save
+            schema_registry.invalidate(table_id=table_obj.pk)
+        return schema_registry.get(table_id=table_obj.pk)
+
+
+    def _get_custom_annotation(self, table_name=None):
+
+        schema = self._get_table_schema(table_name)
+        if schema is None:
             return None
+        return OrderedDict(schema.annotations)
+
+
+    def _get_pruned_columns(self, schema, fields):
+        """
+        Return the dynamic columns to pivot to read fields, all of them when
+        only the row id is requested.
+        """
+        column_names = [name for name in fields if name not in ('id', 'pk')]
+        unknown = [name for name in column_names if name not in schema.column_ids]
+        if unknown:
+            raise FieldError("Cannot resolve keyword %s into field." % ', '.join(repr(name) for name in unknown))
+        if not column_names:
+            # Rows are grouped from their cells: keep them all
+            return [name for name in self._get_columns_name() if name in schema.column_ids]
+        return column_names
+
+
+    def _get_pushdown_filter(self, kwargs):
+        """
+        Translate the simple lookups on dynamic columns into row filters on
+        Cell, applied below the pivot GROUP BY instead of in its HAVING clause.
+        @param :kwargs Lookups as given to filter()
+        @return :tuple (Q on 'primary_key' or None, lookups left to the pivot)
+        """
+        schema = self._get_table_schema()
+        # The materialized pivot is filtered directly
+        if schema is None or materialized.is_materialized(schema):
+            return None, kwargs
+        row_filter = None
+        remaining = {}
+        for key, val in kwargs.items():
+            name, sep, lookup = key.partition('__')
+            lookup = lookup or 'exact'
+            if name in ('id', 'pk') and lookup in ROW_KEY_LOOKUPS:
+                # 'id' is the row key: a condition on Cell.primary_key
+                condition = Q(**{'primary_key__' + lookup: val})
+            elif name in ('id', 'pk') or name not in schema.column_ids or lookup not in PUSHDOWN_LOOKUPS:
+                remaining[key] = val
+                continue
+            else:
+                condition = self._get_cell_condition(schema.column_ids[name], schema.data_types[name], lookup, val)
+            row_filter = condition if row_filter is None else row_filter & condition
+        return row_filter, remaining
+
+
+    def _get_cell_condition(self, column_id, data_type, lookup, val):
+        # Rows having a cell of the column that matches the lookup
+        field = TYPED_VALUE_FIELDS.get(data_type, 'value')
+        if lookup == 'exact' and val is None:
+            lookup, val = 'isnull', True
+        if lookup == 'isnull':
+            not_null = Cell.objects.filter(**{'value_type_id': column_id, field + '__isnull': False}).values('primary_key')
+            # A row without any cell for the column is null too
+            if val:
+                return ~Q(primary_key__in=not_null)
+            return Q(primary_key__in=not_null)
+        if lookup == 'startswith':
+            field = 'value'
+            val = str(val)
+        elif lookup == 'in':
+            val = [to_typed_value(data_type, v) for v in val]
+        else:
+            val = to_typed_value(data_type, val)
+        cells = Cell.objects.filter(**{'value_type_id': column_id, field + '__' + lookup: val}).values('primary_key')
+        return Q(primary_key__in=cells)
+
+
+    def _get_row_condition(self, condition):
+        # The same condition applied to Row: 'primary_key__...' -> 'pk__...'
+        row_condition = Q()
+        row_condition.connector = condition.connector
+        row_condition.negated = condition.negated
+        row_condition.children = [
+            self._get_row_condition(child) if isinstance(child, Q)
+            else ('pk' + child[0][len('primary_key'):], child[1])
+            for child in condition.children
+        ]
+        return row_condition
 
 
     def _get_query_values(self, column_names=None):
@@ -372,16 +1643,11 @@ class DynamicDBModelQuerySet(models.QuerySet):
     
     def _dict_to_object(self, adict):
         """
-        Convert a dictionary to a class
+        Convert a dictionary to an instance of the row class of the model
         @param :adict Dictionary
-        @return :class:DictObj
+        @return :class:DynamicRow
         """
-        res = DictObj(adict)
-        res.save = types.MethodType(self.save, res) # bound save() method to the object
-        res.delete = types.MethodType(self.delete, res) # bound save() method to the object
-        if self.model is not None:
-            res.__class__.__name__ = self.model.__name__
-        return res
+        return get_row_class(self.model)(adict)
 
 
     def as_manager(cls):
@@ -393,6 +1659,53 @@ class DynamicDBModelQuerySet(models.QuerySet):
     as_manager = classmethod(as_manager)
 
 
+class DynamicRow(object):
+    """
+    Base of the row classes returned by get_row_class(): one slot per
+    column of the model instead of a __dict__, and class-level save() and
+    delete().
+    """
+    __slots__ = ()
+    _model = None
+
+    def __init__(self, adict):
+        for name in self.__slots__:
+            setattr(self, name, adict.get(name))
+
+    def _asdict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def save(self):
+        DynamicDBModelQuerySet(self._model).save(self)
+
+    def delete(self):
+        return DynamicDBModelQuerySet(self._model).delete(self)
+
+    def __repr__(self):
+        return '<%s: %s>' % (type(self).__name__, self._asdict())
+
+
+# DynamicDBModel -> row class
+_row_classes = {}
+
+
+def get_row_class(model):
+    """
+    Return the DynamicRow subclass, named after model, holding its rows.
+    """
+    row_class = _row_classes.get(model)
+    if row_class is None:
+        names = set(DynamicDBModelQuerySet(model)._get_columns_name())
+        names.add('id')
+        row_class = type(str(model.__name__), (DynamicRow,), {
+            '__slots__': tuple(sorted(names)),
+            '__module__': model.__module__,
+            '_model': model,
+        })
+        _row_classes[model] = row_class
+    return row_class
+
+
 class DictObj(object):
     def __init__(self, adict):
         # Convert a dictionary to a class @param :adict Dictionary
@@ -421,7 +1734,11 @@ class DynamicDBModelManager(models.Manager):
     ####################################
     
     def get_queryset(self, ids=None):
-        return DynamicDBModelQuerySet(self.model).get_queryset(ids)
+        queryset = DynamicDBModelQuerySet(self.model).get_queryset(ids)
+        if instrumentation.is_enabled():
+            # all(), order_by() and the other QuerySet methods
+            instrumentation.instrument_queryset(queryset, '%s.all' % self.model.__name__)
+        return queryset
 
 
     def get(self, *args, **kwargs):
@@ -429,19 +1746,23 @@ class DynamicDBModelManager(models.Manager):
 
 
     def filter(self, *args, **kwargs):
-        res = self.get_queryset().filter(*args, **kwargs)
+        res = DynamicDBModelQuerySet(self.model).filter(*args, **kwargs)
         res.update = types.MethodType(self.update, res) # bound custom update() method
         res.delete = types.MethodType(self.delete, res) # bound custom delete() method
         return res
 
 
     def exclude(self, *args, **kwargs):
-        res = self.get_queryset().exclude(*args, **kwargs)
+        res = DynamicDBModelQuerySet(self.model).exclude(*args, **kwargs)
         res.update = types.MethodType(self.update, res) # bound custom update() method
         res.delete = types.MethodType(self.delete, res) # bound custom delete() method
         return res
 
 
+    def json_rows(self, *fields, **kwargs):
+        return DynamicDBModelQuerySet(self.model).json_rows(*fields, **kwargs)
+
+
     def union(self, *other_qs, all=False):
         res = self.get_queryset().union(*other_qs, all=False)
         res.update = types.MethodType(self.update, res) # bound custom update() method
@@ -492,25 +1813,49 @@ class DynamicDBModelManager(models.Manager):
 
 
     def defer(self, *fields):
-        res = self.get_queryset().defer(*fields)
+        res = DynamicDBModelQuerySet(self.model).defer(*fields)
         res.update = types.MethodType(self.update, res) # bound custom update() method
         res.delete = types.MethodType(self.delete, res) # bound custom delete() method
         return res
 
 
     def only(self, *fields):
-        res = self.get_queryset().only(*fields)
+        res = DynamicDBModelQuerySet(self.model).only(*fields)
         res.update = types.MethodType(self.update, res) # bound custom update() method
         res.delete = types.MethodType(self.delete, res) # bound custom delete() method
         return res
 
 
+    def values(self, *fields, **expressions):
+        return DynamicDBModelQuerySet(self.model).values(*fields, **expressions)
+
+
+    def cached(self, queryset=None):
+        return DynamicDBModelQuerySet(self.model).cached(queryset)
+
+
+    def count(self):
+        return DynamicDBModelQuerySet(self.model).count()
+
+
+    def exists(self):
+        return DynamicDBModelQuerySet(self.model).exists()
+
+
+    def aggregate(self, *args, **kwargs):
+        return DynamicDBModelQuerySet(self.model).aggregate(*args, **kwargs)
+
+
+    def values_list(self, *fields, flat=False, named=False):
+        return DynamicDBModelQuerySet(self.model).values_list(*fields, flat=flat, named=named)
+
+
     def create(self, **kwargs):
         return DynamicDBModelQuerySet(self.model).create(**kwargs)
 
 
     def bulk_create(self, objs, batch_size=None):
-        pass
+        return DynamicDBModelQuerySet(self.model).bulk_create(objs, batch_size)
 
 
     def get_or_create(self, defaults=None, **kwargs):
@@ -569,6 +1914,7 @@ class DynamicDBModel(models.Model):
         abstract = True
 
 
+    @instrumented
     def save(self):
         try:
             params = self.__dict__
@@ -584,28 +1930,14 @@ class DynamicDBModel(models.Model):
 
 
     def _save(self, **kwargs):
-        # Check if provided kwargs is valid
-        defaults = {}
+        self.id = DynamicDBModelQuerySet(self.__class__)._save(**kwargs)
 
-        lookup, params = DynamicDBModelQuerySet(self)._extract_model_params(defaults, **kwargs)
-        
-        table_name = convert(self.__class__.__name__)
-        
-        table_obj, table_created = Table.objects.get_or_create(name=table_name)
-        
-        obj_id = kwargs.pop('id', None)
-        
-        # Check if it is new row
-        if obj_id is None:
-            row_obj = Row.objects.create(table=table_obj)
-        else:
-            row_obj = Row.objects.get(pk=obj_id, table=table_obj)
-                
-        for attr, val in list(params.items()):
-            col_obj, col_created = Column.objects.get_or_create(table=table_obj, name=attr)
-            # if attr == 'weight':
-            #     print(val)
-            cell_obj = Cell.objects.update_or_create(primary_key=row_obj, value_type=col_obj, value=str(val))
+
+    @instrumented
+    def delete(self):
+        return DynamicDBModelQuerySet(self.__class__)._delete_object(**{
+            field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields
+        })
 
 
 """
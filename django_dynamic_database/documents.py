@@ -0,0 +1,99 @@
+"""
+
+JSON documents of the rows of the dynamic tables.
+
+When DYNAMIC_DATABASE_ROW_DATA is set, Row.data holds the values of the
+cells of the row as a JSON object keyed by column id, the same object as
+DynamicDBModelQuerySet.json_rows() reads. The write paths refresh it
+through the post_rows_save signal (see receivers.py), in one UPDATE per
+write, and the reads by id and the REST views read it instead of pivoting
+the cells.
+
+Documents are built for the rows written after the setting is turned on:
+run the build_row_data command to fill the existing rows.
+
+"""
+from functools import partial
+
+from django.conf import settings
+from django.db import models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Row, Cell
+
+
+def is_enabled():
+    return getattr(settings, 'DYNAMIC_DATABASE_ROW_DATA', False)
+
+
+def get_documents():
+    # The document of the row of the outer query, aggregated from its cells
+    from .django_dynamic_database import JSONObjectAgg
+
+    return Cell.objects.filter(primary_key_id=OuterRef('pk')).values('primary_key').annotate(
+        document=JSONObjectAgg(Cast('value_type_id', models.CharField()), 'value')
+    ).values('document').order_by()
+
+
+def refresh_rows(table_id, row_ids=None):
+    """
+    Rebuild the documents of the given rows (all the rows of the table if
+    None) from their cells, in a single UPDATE.
+    @return :int Number of rows updated
+    """
+    rows = Row.objects.filter(table_id=table_id)
+    if row_ids is not None:
+        rows = rows.filter(pk__in=row_ids)
+    return rows.update(data=Subquery(get_documents(), output_field=models.TextField()))
+
+
+def get_rows(schema, row_ids=None):
+    """
+    Return the rows of schema read from their documents, as a queryset of
+    dicts like json_rows(). The rows without a document yet are read from
+    their cells.
+    """
+    from .django_dynamic_database import JSONRowIterable
+
+    fields = [name for name in schema.column_ids if name not in ('id', 'pk')]
+    rows = Row.objects.filter(table_id=schema.table_id)
+    if row_ids is not None:
+        rows = rows.filter(pk__in=row_ids)
+    rows = rows.annotate(
+        document=Coalesce('data', Subquery(get_documents(), output_field=models.TextField()))
+    ).values_list('pk', 'document').order_by()
+    rows._iterable_class = partial(JSONRowIterable, schema=schema, fields=fields)
+    return rows
+
+
+def get_row(schema, row_id):
+    """
+    Return one row read from its document, or None when it has no document.
+    """
+    from .django_dynamic_database import decode_json_row
+
+    data = Row.objects.filter(pk=row_id, table_id=schema.table_id).values_list('data', flat=True).first()
+    if data is None:
+        return None
+    fields = [name for name in schema.column_ids if name not in ('id', 'pk')]
+    return decode_json_row(schema, fields, row_id, data)
+
+
+def verify_rows(schema, chunk_size=2000):
+    """
+    Compare the documents of the table of schema with its cells.
+    @return :list Ids of the rows whose document is missing or stale
+    """
+    from .django_dynamic_database import decode_json_row
+
+    documents = Row.objects.filter(table_id=schema.table_id).annotate(
+        document=Subquery(get_documents(), output_field=models.TextField())
+    ).values_list('pk', 'data', 'document').order_by('pk')
+    fields = [name for name in schema.column_ids if name not in ('id', 'pk')]
+    stale = []
+    for row_id, data, document in documents.iterator(chunk_size=chunk_size):
+        # Decoded, so that the order of the keys does not matter
+        if decode_json_row(schema, fields, row_id, data) != decode_json_row(schema, fields, row_id, document):
+            stale.append(row_id)
+    return stale
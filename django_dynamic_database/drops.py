@@ -0,0 +1,187 @@
+"""
+
+Chunked drop of dynamic tables and columns.
+
+Table.delete() and Column.delete() go through the deletion Collector, which
+loads the related Rows into memory and deletes them in one transaction. The
+functions below delete the Cells, then the Rows, in batches of consecutive
+ids, each batch in its own transaction, and delete the Table or the Column
+last, once nothing refers to it: the Collector then has nothing to load, and
+the signals of the Table and the Column are sent as usual. When Cell is
+partitioned and the table has its own partition, the partition is dropped
+at once instead of deleting the cells in batches; only the rows are.
+
+A drop may run in a background thread: DropJob.start(). The progress of the
+drop of a table is saved on the Table, so that every process sees it and
+only one job drops a table at once. The thread dies with its process: a
+drop whose heartbeat is older than DYNAMIC_DATABASE_DROP_TIMEOUT seconds
+(300) is taken over by the next drop of the table, which carries on where
+it stopped.
+
+"""
+import datetime
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Min, Max, Q
+from django.utils import timezone
+
+from .models import Table, Column, Row, Cell
+from . import partitions
+
+
+BATCH_SIZE = 10000
+
+logger = logging.getLogger('django_dynamic_database')
+
+
+class DropInProgress(ValueError):
+    pass
+
+
+def get_timeout():
+    return getattr(settings, 'DYNAMIC_DATABASE_DROP_TIMEOUT', 300)
+
+
+def delete_by_range(queryset, batch_size=BATCH_SIZE, progress=None):
+    """
+    Delete the objects of queryset in batches of batch_size consecutive
+    ids, without loading them. Return the number of objects deleted.
+    """
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return 0
+    deleted = 0
+    for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+        with transaction.atomic():
+            chunk = queryset.filter(pk__gte=start, pk__lt=start + batch_size)
+            num = chunk._raw_delete(chunk.db)
+        deleted += num
+        if progress is not None and num:
+            progress(num)
+    return deleted
+
+
+def get_progress(table_id):
+    """
+    Return the progress of the drop of a table as saved by the job that
+    drops it: the numbers of cells and rows deleted so far, and whether a
+    job is running.
+    """
+    table = Table.objects.filter(pk=table_id).values('drop_heartbeat', 'dropped_cells', 'dropped_rows').first()
+    if table is None:
+        return {'table': table_id, 'cells': None, 'rows': None, 'running': False, 'done': True}
+    return {
+        'table': table_id, 'cells': table['dropped_cells'], 'rows': table['dropped_rows'],
+        'running': table['drop_heartbeat'] is not None, 'done': False,
+    }
+
+
+class DropJob(object):
+    """
+    Drop of a Table or a Column. progress holds the number of cells and
+    rows deleted by the job, whether it is done and its error if any.
+    callback, if given, is called with progress after each batch.
+    """
+
+    def __init__(self, obj, batch_size=BATCH_SIZE, callback=None):
+        self.obj = obj
+        self.batch_size = batch_size
+        self.callback = callback
+        self.progress = {
+            obj._meta.model_name: obj.pk, 'cells': 0, 'rows': 0, 'done': False, 'error': None,
+        }
+        self.thread = None
+
+    def claim(self):
+        """
+        Mark the table as dropped by this job. Return False when another
+        job, whose heartbeat is recent, drops it already.
+        """
+        if isinstance(self.obj, Column):
+            return True
+        now = timezone.now()
+        stale = now - datetime.timedelta(seconds=get_timeout())
+        return bool(Table.objects.filter(pk=self.obj.pk).filter(
+            Q(drop_heartbeat__isnull=True) | Q(drop_heartbeat__lt=stale)
+        ).update(drop_heartbeat=now))
+
+    def release(self):
+        if not isinstance(self.obj, Column):
+            Table.objects.filter(pk=self.obj.pk).update(drop_heartbeat=None)
+
+    def _count(self, name):
+        def count(num):
+            self.progress[name] += num
+            if not isinstance(self.obj, Column):
+                Table.objects.filter(pk=self.obj.pk).update(**{
+                    'drop_heartbeat': timezone.now(), 'dropped_' + name: F('dropped_' + name) + num,
+                })
+            if self.callback is not None:
+                self.callback(self.progress)
+        return count
+
+    def run(self, claimed=False):
+        """
+        Drop the object. Raise DropInProgress when another job drops it.
+        """
+        if not claimed and not self.claim():
+            raise DropInProgress('%s is being dropped by another job.' % self.obj)
+        try:
+            if isinstance(self.obj, Column):
+                self.drop_column()
+            else:
+                self.drop_table()
+        except Exception as e:
+            self.progress['error'] = str(e)
+            # Another job may start over
+            self.release()
+            raise
+        finally:
+            self.progress['done'] = True
+        return self.progress
+
+    def drop_table(self):
+        table = self.obj
+        if partitions.has_partition(table.pk):
+            with transaction.atomic():
+                partitions.drop_partition(table.pk)
+        else:
+            delete_by_range(Cell.objects.filter(table_id=table.pk), self.batch_size, self._count('cells'))
+        delete_by_range(Row.objects.filter(table_id=table.pk), self.batch_size, self._count('rows'))
+        with transaction.atomic():
+            table.delete()
+
+    def drop_column(self):
+        column = self.obj
+        delete_by_range(Cell.objects.filter(value_type_id=column.pk), self.batch_size, self._count('cells'))
+        column.delete()
+
+    def _run_in_thread(self):
+        try:
+            self.run(claimed=True)
+        except Exception:
+            logger.exception('Drop of %s failed.', self.obj)
+        finally:
+            connection.close()
+
+    def start(self):
+        """
+        Run the drop in a background thread. Return None, without starting
+        it, when another job drops the object already.
+        """
+        if not self.claim():
+            return None
+        self.thread = threading.Thread(target=self._run_in_thread, daemon=True)
+        self.thread.start()
+        return self
+
+
+def drop_table(table, batch_size=BATCH_SIZE, callback=None):
+    return DropJob(table, batch_size, callback).run()
+
+
+def drop_column(column, batch_size=BATCH_SIZE, callback=None):
+    return DropJob(column, batch_size, callback).run()
@@ -0,0 +1,185 @@
+"""
+
+Streaming export of a dynamic table.
+
+The rows are read in primary key order through QuerySet.iterator(), a
+server-side cursor on PostgreSQL, and encoded chunk by chunk: an export
+holds one chunk of rows in memory whatever the size of the table. The
+materialized pivot is read when the table has one.
+
+Formats:
+
+csv
+    A header line with 'id' and the column names, then one line per row.
+ndjson
+    One JSON object per row.
+columnar
+    Blocks of rows stored column by column. All integers are little endian:
+
+    - b'DDBC', the format version (uint8), the length (uint32) of a UTF-8
+      JSON header {"columns": [{"name", "type"}]} and the header. 'id' is
+      the first column, of type integer.
+    - For each block: its number of rows n (uint32), then for each column
+      a null bitmap of ceil(n / 8) bytes (bit i of byte i // 8 is set when
+      the value of row i is NULL) followed by the values: int64 for the
+      integer columns, float64 for the float ones, and for the others n
+      lengths (uint32) followed by the UTF-8 bytes of the values. Dates and
+      datetimes are ISO 8601 strings. NULL values are 0 or empty.
+    - A block of 0 rows ends the stream.
+
+"""
+import csv
+import io
+import json
+import struct
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Column, Cell
+from . import materialized
+
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+COLUMNAR = 'columnar'
+
+CONTENT_TYPES = {
+    CSV: 'text/csv',
+    NDJSON: 'application/x-ndjson',
+    COLUMNAR: 'application/octet-stream',
+}
+
+COLUMNAR_MAGIC = b'DDBC'
+COLUMNAR_VERSION = 1
+
+# Rows read per database round-trip and encoded at once
+CHUNK_SIZE = 2000
+
+
+def get_columns(schema):
+    # (name, data type) of the exported columns, 'id' first
+    return [('id', Column.INTEGER)] + [(name, data_type) for pk, name, data_type in materialized.get_columns(schema)]
+
+
+def get_rows(schema, chunk_size=CHUNK_SIZE):
+    """
+    Yield the rows of schema as tuples of the values of get_columns(), in
+    primary key order.
+    """
+    names = [name for name, data_type in get_columns(schema)[1:]]
+    if materialized.is_materialized(schema):
+        rows = materialized.get_pivot_model(schema).objects.values_list('id', *names).order_by('id')
+    else:
+        annotations = dict((name, schema.annotations[name]) for name in names)
+        rows = Cell.objects.filter(table_id=schema.table_id).values('primary_key').annotate(
+            **annotations
+        ).values_list('primary_key', *names).order_by('primary_key')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def iter_chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_csv(columns, chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([name for name, data_type in columns])
+    yield buf.getvalue()
+    for chunk in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(chunk)
+        yield buf.getvalue()
+
+
+def encode_ndjson(columns, chunks):
+    names = [name for name, data_type in columns]
+    for chunk in chunks:
+        yield ''.join(json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n' for row in chunk)
+
+
+def encode_column(data_type, values):
+    n = len(values)
+    nulls = bytearray((n + 7) // 8)
+    for i, val in enumerate(values):
+        if val is None:
+            nulls[i // 8] |= 1 << (i % 8)
+    if data_type == Column.INTEGER:
+        return bytes(nulls) + struct.pack('<%dq' % n, *[0 if val is None else int(val) for val in values])
+    if data_type == Column.FLOAT:
+        return bytes(nulls) + struct.pack('<%dd' % n, *[0.0 if val is None else float(val) for val in values])
+    data = [
+        b'' if val is None else (val.isoformat() if hasattr(val, 'isoformat') else str(val)).encode('utf-8')
+        for val in values
+    ]
+    return bytes(nulls) + struct.pack('<%dI' % n, *[len(val) for val in data]) + b''.join(data)
+
+
+def encode_columnar(columns, chunks):
+    header = json.dumps({'columns': [{'name': name, 'type': data_type} for name, data_type in columns]}).encode('utf-8')
+    yield COLUMNAR_MAGIC + struct.pack('<BI', COLUMNAR_VERSION, len(header)) + header
+    for chunk in chunks:
+        block = [struct.pack('<I', len(chunk))]
+        for (name, data_type), values in zip(columns, zip(*chunk)):
+            block.append(encode_column(data_type, values))
+        yield b''.join(block)
+    yield struct.pack('<I', 0)
+
+
+ENCODERS = {
+    CSV: encode_csv,
+    NDJSON: encode_ndjson,
+    COLUMNAR: encode_columnar,
+}
+
+
+def export_rows(schema, format=CSV, chunk_size=CHUNK_SIZE):
+    """
+    Yield the encoded rows of the table of schema, one piece per chunk of
+    chunk_size rows: str for csv and ndjson, bytes for columnar.
+    """
+    if format not in ENCODERS:
+        raise ValueError('Unknown export format: %s.' % format)
+    columns = get_columns(schema)
+    chunks = iter_chunks(get_rows(schema, chunk_size), chunk_size)
+    return ENCODERS[format](columns, chunks)
+
+
+def decode_columnar(stream):
+    """
+    Read a columnar export from a binary file object and return its column
+    names and its rows, as tuples.
+    """
+    def read(size):
+        data = stream.read(size)
+        if len(data) != size:
+            raise ValueError('Truncated columnar export.')
+        return data
+
+    if read(4) != COLUMNAR_MAGIC:
+        raise ValueError('Not a columnar export.')
+    version, size = struct.unpack('<BI', read(5))
+    columns = json.loads(read(size).decode('utf-8'))['columns']
+    rows = []
+    while True:
+        n, = struct.unpack('<I', read(4))
+        if not n:
+            break
+        block = []
+        for column in columns:
+            nulls = read((n + 7) // 8)
+            if column['type'] in (Column.INTEGER, Column.FLOAT):
+                values = list(struct.unpack('<%d%s' % (n, 'q' if column['type'] == Column.INTEGER else 'd'), read(8 * n)))
+            else:
+                lengths = struct.unpack('<%dI' % n, read(4 * n))
+                values = [read(length).decode('utf-8') for length in lengths]
+            block.append([None if nulls[i // 8] & (1 << (i % 8)) else val for i, val in enumerate(values)])
+        rows.extend(zip(*block))
+    return [column['name'] for column in columns], rows
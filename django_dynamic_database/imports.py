@@ -0,0 +1,226 @@
+"""
+
+Bulk import of rows into a dynamic table.
+
+The rows are read from a CSV body, whose first line names the columns, or
+from an NDJSON body, one JSON object per line. Column names are resolved to
+Column ids once, through the schema registry, and the rows are written in
+batches of Rows and Cells, each batch in its own transaction. On PostgreSQL
+the Cells of a batch are loaded with COPY into a temporary staging table and
+moved into Cell with a single INSERT ... SELECT.
+
+A line that cannot be read or converted to the type of its columns is
+reported with its line number and skipped: it does not abort the load. When
+the database rejects a batch, its rows are written again one by one and the
+lines rejected are reported.
+
+"""
+import csv
+import io
+import json
+import time
+
+from django.db import DatabaseError, connection, transaction
+
+from .models import Table, Cell
+from .signals import post_rows_save
+from .django_dynamic_database import (
+    TYPED_VALUE_FIELDS, UPSERT_FIELDS, bulk_create_rows, get_cell_values,
+)
+
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+
+# Content types of the import bodies
+FORMATS = {
+    'text/csv': CSV,
+    'application/x-ndjson': NDJSON,
+    'application/ndjson': NDJSON,
+}
+
+STAGING_TABLE = 'ddb_cell_staging'
+
+
+def get_format(content_type):
+    return FORMATS.get((content_type or '').split(';')[0].strip().lower())
+
+
+def iter_csv(lines):
+    """
+    Yield (line number, record or error message) for the lines of a CSV
+    body. The first line holds the column names.
+    """
+    reader = csv.reader(lines)
+    try:
+        header = next(reader)
+    except StopIteration:
+        return
+    yield 1, header
+    for record in reader:
+        if not record:
+            continue
+        if len(record) != len(header):
+            yield reader.line_num, 'Expected %s values, got %s.' % (len(header), len(record))
+            continue
+        yield reader.line_num, record
+
+
+def iter_ndjson(lines):
+    """
+    Yield (line number, record or error message) for the lines of an NDJSON
+    body.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, 'Invalid JSON: %s.' % e
+            continue
+        if not isinstance(record, dict):
+            yield number, 'Expected a JSON object.'
+            continue
+        yield number, record
+
+
+def get_cells(schema, data):
+    """
+    Return the Cell field values of each column of schema for the row data,
+    in the order of schema.columns. Columns missing from data are NULL.
+    """
+    cells = []
+    for column_id, name in schema.columns.items():
+        data_type = schema.data_types[name]
+        val = data.get(name)
+        try:
+            values = get_cell_values(data_type, val)
+        except (TypeError, ValueError):
+            values = None
+        typed = TYPED_VALUE_FIELDS.get(data_type)
+        if values is None or (typed and values[typed] is None and val not in (None, '')):
+            raise ValueError('Invalid %s value for %s: %r.' % (data_type, name, val))
+        cells.append((column_id, values))
+    return cells
+
+
+def copy_value(val):
+    # Text format of COPY
+    if val is None:
+        return '\\N'
+    return str(val).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_cells(cells):
+    """
+    Insert cells with COPY into a staging table and a single
+    INSERT ... SELECT. PostgreSQL only, inside a transaction.
+    """
+    qn = connection.ops.quote_name
+    fields = [Cell._meta.get_field(name) for name in UPSERT_FIELDS]
+    columns = ', '.join(qn(field.column) for field in fields)
+    buf = io.StringIO()
+    for cell in cells:
+        buf.write('\t'.join(
+            copy_value(field.get_db_prep_save(getattr(cell, field.attname), connection)) for field in fields
+        ) + '\n')
+    buf.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE IF NOT EXISTS %s ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA' % (
+            qn(STAGING_TABLE), columns, qn(Cell._meta.db_table),
+        ))
+        cursor.cursor.copy_expert('COPY %s (%s) FROM STDIN' % (qn(STAGING_TABLE), columns), buf)
+        cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s' % (
+            qn(Cell._meta.db_table), columns, columns, qn(STAGING_TABLE),
+        ))
+        # The table lives until the end of the outermost transaction
+        cursor.execute('TRUNCATE %s' % qn(STAGING_TABLE))
+
+
+def write_rows(schema, rows, sender=Table):
+    """
+    Insert rows, lists of (column id, Cell values) as returned by
+    get_cells(), in one transaction. Return their ids.
+    """
+    with transaction.atomic():
+        row_ids = bulk_create_rows(schema.table_id, len(rows))
+        cells = [
+            Cell(table_id=schema.table_id, primary_key_id=row_id, value_type_id=column_id, **values)
+            for row_id, row in zip(row_ids, rows)
+            for column_id, values in row
+        ]
+        if connection.vendor == 'postgresql':
+            copy_cells(cells)
+        else:
+            Cell.objects.bulk_create(cells)
+        post_rows_save.send(sender=sender, table_id=schema.table_id, row_ids=row_ids)
+    return row_ids
+
+
+def import_rows(schema, lines, format=CSV, batch_size=5000, sender=Table):
+    """
+    Import the rows of a CSV or NDJSON body, given as an iterable of text
+    lines, into the table of schema. Raise ValueError when the CSV header
+    names an unknown column.
+    @return :dict {'rows': number of rows imported, 'errors': [{'line',
+    'detail'}], 'seconds', 'rows_per_second'}
+    """
+    start = time.time()
+    errors = []
+    imported = 0
+    batch = []
+    lines_of_batch = []
+
+    def flush():
+        try:
+            return len(write_rows(schema, batch, sender=sender))
+        except DatabaseError as e:
+            if len(batch) == 1:
+                errors.append({'line': lines_of_batch[0], 'detail': str(e)})
+                return 0
+        # Write the rows of the failed batch one by one, to report the bad
+        # lines only
+        written = 0
+        for number, row in zip(lines_of_batch, batch):
+            try:
+                written += len(write_rows(schema, [row], sender=sender))
+            except DatabaseError as e:
+                errors.append({'line': number, 'detail': str(e)})
+        return written
+
+    records = iter_csv(lines) if format == CSV else iter_ndjson(lines)
+    header = None
+    for number, record in records:
+        if format == CSV and header is None:
+            unknown = [name for name in record if name not in schema.column_ids]
+            if unknown:
+                raise ValueError('Unknown columns: %s.' % ', '.join(sorted(unknown)))
+            header = record
+            continue
+        if isinstance(record, str):
+            errors.append({'line': number, 'detail': record})
+            continue
+        if header is not None:
+            record = dict(zip(header, record))
+        unknown = [name for name in record if name not in schema.column_ids]
+        try:
+            if unknown:
+                raise ValueError('Unknown columns: %s.' % ', '.join(sorted(unknown)))
+            batch.append(get_cells(schema, record))
+        except ValueError as e:
+            errors.append({'line': number, 'detail': str(e)})
+            continue
+        lines_of_batch.append(number)
+        if len(batch) >= batch_size:
+            imported += flush()
+            batch, lines_of_batch = [], []
+    if batch:
+        imported += flush()
+    seconds = time.time() - start
+    return {
+        'rows': imported,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(imported / seconds, 1) if seconds else None,
+    }
@@ -0,0 +1,180 @@
+"""
+
+Instrumentation of the dynamic models and of the REST views.
+
+With DYNAMIC_DATABASE_INSTRUMENTATION set, each call of a public method of
+DynamicDBModelQuerySet, which the manager delegates to, of DynamicDBModel
+save() and delete(), and of the views records through
+connection.execute_wrapper():
+
+- queries: the number of SQL queries,
+- sql_time: the time spent in them, in seconds,
+- python_time: the rest of the time of the call,
+- rows: the number of rows returned, when the call returns a list or a
+  queryset. A queryset, and the querysets chained from it, are measured
+  again when they are evaluated, under the name of the call.
+
+The querysets of the manager, all(), order_by() and the like, are measured
+when they are evaluated, as '<model name>.all'. count(), exists() and
+aggregate() on a measured queryset are measured too.
+
+The queries run while a streamed response is sent, the exports, happen after
+the view has returned: they are not counted.
+
+Only the outermost call is recorded: Model.objects.get() is one operation,
+whatever it calls. The stats are sent with the operation_finished signal,
+logged at DEBUG level to the 'django_dynamic_database' logger and passed to
+DYNAMIC_DATABASE_INSTRUMENTATION_CALLBACK, a callable or its dotted path
+called with (operation, stats), e.g. to send them to statsd.
+
+The queries of an instrumented operation slower than
+DYNAMIC_DATABASE_SLOW_QUERY_MS (500) are logged with their SQL at WARNING
+level.
+
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.utils.module_loading import import_string
+
+from .signals import operation_finished
+
+
+logger = logging.getLogger('django_dynamic_database')
+
+_local = threading.local()
+
+
+def is_enabled():
+    return getattr(settings, 'DYNAMIC_DATABASE_INSTRUMENTATION', False)
+
+
+def get_callback():
+    callback = getattr(settings, 'DYNAMIC_DATABASE_INSTRUMENTATION_CALLBACK', None)
+    if isinstance(callback, str):
+        callback = import_string(callback)
+    return callback
+
+
+def emit(operation, stats):
+    logger.debug(
+        '%s: %d queries, %.1f ms SQL, %.1f ms Python, %s rows', operation, stats['queries'],
+        stats['sql_time'] * 1000, stats['python_time'] * 1000, stats['rows'],
+    )
+    operation_finished.send(sender=None, operation=operation, stats=stats)
+    callback = get_callback()
+    if callback is not None:
+        callback(operation, stats)
+
+
+@contextmanager
+def instrument(operation):
+    """
+    Record the queries run inside the block as one operation. Yield the
+    stats, to which the caller may add 'rows', or None when instrumentation
+    is off or an operation is already being recorded.
+    """
+    if not is_enabled() or getattr(_local, 'operation', None) is not None:
+        yield None
+        return
+    stats = {'queries': 0, 'sql_time': 0.0, 'python_time': 0.0, 'rows': None}
+    slow = getattr(settings, 'DYNAMIC_DATABASE_SLOW_QUERY_MS', 500) / 1000.0
+
+    def wrapper(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            stats['queries'] += 1
+            stats['sql_time'] += duration
+            if duration >= slow:
+                logger.warning('Slow query in %s (%.1f ms): %s; params: %r', operation, duration * 1000, sql, params)
+
+    _local.operation = operation
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(wrapper):
+            yield stats
+    finally:
+        _local.operation = None
+        stats['python_time'] = max(time.perf_counter() - start - stats['sql_time'], 0.0)
+        emit(operation, stats)
+
+
+class InstrumentedQuerySetMixin(object):
+    """
+    Record the evaluation of the queryset as self.operation, with the
+    number of rows, and its count(), exists() and aggregate(). The querysets
+    chained from it are of the same class and are recorded too.
+    """
+
+    operation = None
+
+    def _fetch_all(self):
+        if self._result_cache is not None:
+            return super(InstrumentedQuerySetMixin, self)._fetch_all()
+        with instrument(self.operation) as stats:
+            super(InstrumentedQuerySetMixin, self)._fetch_all()
+            if stats is not None:
+                stats['rows'] = len(self._result_cache)
+
+    def count(self):
+        with instrument(self.operation):
+            return super(InstrumentedQuerySetMixin, self).count()
+
+    def exists(self):
+        with instrument(self.operation):
+            return super(InstrumentedQuerySetMixin, self).exists()
+
+    def aggregate(self, *args, **kwargs):
+        with instrument(self.operation):
+            return super(InstrumentedQuerySetMixin, self).aggregate(*args, **kwargs)
+
+
+# (QuerySet class, operation) -> instrumented subclass
+_queryset_classes = {}
+
+
+def instrument_queryset(queryset, operation):
+    """
+    Record the evaluation of queryset, and of the querysets chained from
+    it, as operation.
+    """
+    cls = type(queryset)
+    if issubclass(cls, InstrumentedQuerySetMixin):
+        cls = cls.__bases__[1]
+    key = (cls, operation)
+    subclass = _queryset_classes.get(key)
+    if subclass is None:
+        subclass = _queryset_classes[key] = type(
+            str('Instrumented%s' % cls.__name__), (InstrumentedQuerySetMixin, cls), {'operation': operation},
+        )
+    queryset.__class__ = subclass
+    return queryset
+
+
+def instrumented(method):
+    """
+    Decorator of the methods of the querysets and views: record each call
+    as the operation '<model or class name>.<method name>'.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not is_enabled():
+            return method(self, *args, **kwargs)
+        operation = '%s.%s' % (getattr(getattr(self, 'model', None), '__name__', None) or type(self).__name__, method.__name__)
+        with instrument(operation) as stats:
+            result = method(self, *args, **kwargs)
+            if isinstance(result, QuerySet) and result._result_cache is None:
+                instrument_queryset(result, operation)
+            elif stats is not None and isinstance(result, list):
+                stats['rows'] = len(result)
+        return result
+    return wrapper
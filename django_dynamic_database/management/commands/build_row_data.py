@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_dynamic_database import documents
+from django_dynamic_database.django_dynamic_database import schema_registry
+
+from .materialize_table import get_table
+
+
+class Command(BaseCommand):
+    help = 'Build or verify the JSON documents (Row.data) of the rows of a dynamic table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help='Table name or id.')
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare the documents with the cells and report the stale rows.',
+        )
+
+    def handle(self, *args, **options):
+        table = get_table(options['table'])
+        schema = schema_registry.get(table_id=table.pk)
+        if options['verify']:
+            stale = documents.verify_rows(schema)
+            if stale:
+                raise CommandError('%d stale documents in %s, rows: %s.' % (
+                    len(stale), table.name, ', '.join(str(pk) for pk in stale[:20]) + (' ...' if len(stale) > 20 else ''),
+                ))
+            self.stdout.write('The documents of %s are up to date.' % table.name)
+        else:
+            num = documents.refresh_rows(table.pk)
+            self.stdout.write('Built the documents of %s (%d rows).' % (table.name, num))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_dynamic_database import drops
+
+from .materialize_table import get_table
+
+
+class Command(BaseCommand):
+    help = 'Delete a dynamic table, its rows and its cells in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help='Table name or id.')
+        parser.add_argument(
+            '--batch-size', type=int, default=drops.BATCH_SIZE,
+            help='Cells or rows deleted per transaction (default: %d).' % drops.BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        table = get_table(options['table'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        name = table.name
+        callback = None
+        if options['verbosity'] > 1:
+            callback = lambda progress: self.stdout.write('%(cells)d cells, %(rows)d rows deleted' % progress)
+        try:
+            progress = drops.drop_table(table, options['batch_size'], callback)
+        except drops.DropInProgress as e:
+            raise CommandError(str(e))
+        self.stdout.write('Dropped %s (%d cells, %d rows).' % (name, progress['cells'], progress['rows']))
@@ -0,0 +1,45 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_dynamic_database import exports
+from django_dynamic_database.django_dynamic_database import schema_registry
+
+from .materialize_table import get_table
+
+
+class Command(BaseCommand):
+    help = 'Stream the rows of a dynamic table to a file or to the standard output.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help='Table name or id.')
+        parser.add_argument(
+            '--format', default=exports.CSV, choices=sorted(exports.ENCODERS),
+            help='Output format (default: csv).',
+        )
+        parser.add_argument('-o', '--output', help='Output file (default: standard output).')
+        parser.add_argument(
+            '--chunk-size', type=int, default=exports.CHUNK_SIZE,
+            help='Rows read per database round-trip (default: %d).' % exports.CHUNK_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        table = get_table(options['table'])
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        schema = schema_registry.get(table_id=table.pk)
+        binary = options['format'] == exports.COLUMNAR
+        if options['output']:
+            # The csv module writes its own line endings
+            out = open(options['output'], 'wb') if binary else open(options['output'], 'w', newline='')
+        else:
+            out = sys.stdout.buffer if binary else self.stdout
+        try:
+            for piece in exports.export_rows(schema, options['format'], options['chunk_size']):
+                if out is self.stdout:
+                    out.write(piece, ending='')
+                else:
+                    out.write(piece)
+        finally:
+            if options['output']:
+                out.close()
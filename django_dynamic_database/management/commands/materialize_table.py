@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_dynamic_database.materialized import materialize_table, dematerialize_table
+from django_dynamic_database.models import Table
+
+
+class Command(BaseCommand):
+    help = 'Build, rebuild or drop the materialized pivot of a dynamic table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help='Table name or id.')
+        parser.add_argument(
+            '--drop', action='store_true',
+            help='Drop the materialized pivot and read the table from its cells again.',
+        )
+
+    def handle(self, *args, **options):
+        table = get_table(options['table'])
+        if options['drop']:
+            dematerialize_table(table)
+            self.stdout.write('Dropped the materialized pivot of %s.' % table.name)
+        else:
+            materialize_table(table)
+            self.stdout.write('Built the materialized pivot of %s (%d rows).' % (table.name, table.rows.count()))
+
+
+def get_table(name_or_id):
+    tables = Table.objects.filter(name=name_or_id)
+    if name_or_id.isdigit():
+        tables = Table.objects.filter(pk=int(name_or_id)) | tables
+    try:
+        return tables.get()
+    except Table.DoesNotExist:
+        raise CommandError('Table "%s" does not exist.' % name_or_id)
+    except Table.MultipleObjectsReturned:
+        raise CommandError('Several tables are named "%s": use the table id.' % name_or_id)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_dynamic_database import partitions
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Cell as a table partitioned by dynamic table (PostgreSQL 11 or later).'
+
+    def handle(self, *args, **options):
+        try:
+            num = partitions.partition_cells()
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            'Partitioned the cells of %d tables. Set DYNAMIC_DATABASE_PARTITION_CELLS to keep one '
+            'partition per table.' % num
+        )
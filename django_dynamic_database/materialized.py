@@ -0,0 +1,288 @@
+"""
+
+Materialized pivot of a dynamic table.
+
+When Table.materialized is set, the pivot of the table is kept in a real
+wide table, django_dynamic_database_pivot_<table id>, with one row per Row
+and one column per Column named c_<column id>. The write paths refresh the
+rows they touch through the post_rows_save and pre_rows_delete signals (see
+receivers.py), and DynamicDBModelQuerySet.get_queryset() reads it directly
+instead of aggregating the cells.
+
+Columns are named after their id so that renaming a Column does not touch
+the table. Added columns are added in place, removed columns rebuild it.
+These changes are made when the transaction that changes the columns
+commits: until then, it reads the table from its cells, and the rows it
+writes are refreshed after the change.
+
+The processes learn that a table is materialized, and the columns of its
+pivot, from the schema registry: DYNAMIC_DATABASE_SCHEMA_CACHE must be set.
+
+"""
+import threading
+from functools import partial
+
+from django.apps.registry import Apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, models, transaction
+
+from .models import Column, Cell
+
+
+# Registry of the generated pivot models, kept out of the project apps
+pivot_apps = Apps()
+
+# table id -> pivot model of its current columns
+_pivot_models = {}
+_pivot_models_lock = threading.Lock()
+
+# Column changes of the transaction in progress of each thread
+_local = threading.local()
+
+PIVOT_FIELDS = {
+    Column.TEXT: lambda column: models.CharField(max_length=500, null=True, db_column=column),
+    Column.INTEGER: lambda column: models.BigIntegerField(null=True, db_column=column),
+    Column.FLOAT: lambda column: models.FloatField(null=True, db_column=column),
+    Column.DATE: lambda column: models.DateField(null=True, db_column=column),
+    Column.DATETIME: lambda column: models.DateTimeField(null=True, db_column=column),
+}
+
+
+def get_table_name(table_id):
+    return '%s_pivot_%s' % (Cell._meta.app_label, table_id)
+
+
+def get_column_name(column_id):
+    return 'c_%s' % column_id
+
+
+def get_columns(schema):
+    # (column id, column name, data type) of the columns of the pivot
+    return [
+        (pk, name, schema.data_types[name])
+        for pk, name in schema.columns.items()
+        # 'id' is the row key
+        if name not in ('id', 'pk')
+    ]
+
+
+def check_settings():
+    if getattr(settings, 'DYNAMIC_DATABASE_SCHEMA_CACHE', None) is None:
+        raise ImproperlyConfigured(
+            'Materialized tables need DYNAMIC_DATABASE_SCHEMA_CACHE to share their schema between processes.'
+        )
+
+
+def get_pivot_model(schema):
+    """
+    Return the unmanaged model mapping the pivot table of schema. The model
+    of the former columns of the table is unregistered.
+    """
+    check_settings()
+    columns = tuple(get_columns(schema))
+    model = _pivot_models.get(schema.table_id)
+    if model is not None and model.pivot_columns == columns:
+        return model
+    with _pivot_models_lock:
+        meta = type('Meta', (), {
+            'apps': pivot_apps,
+            'app_label': Cell._meta.app_label,
+            'db_table': get_table_name(schema.table_id),
+            'managed': False,
+        })
+        attrs = {'__module__': __name__, 'Meta': meta, 'id': models.IntegerField(primary_key=True)}
+        for pk, name, data_type in columns:
+            attrs[name] = PIVOT_FIELDS.get(data_type, PIVOT_FIELDS[Column.TEXT])(get_column_name(pk))
+        name = str('Pivot%s' % schema.table_id)
+        pivot_apps.all_models[Cell._meta.app_label].pop(name.lower(), None)
+        model = type(name, (models.Model,), attrs)
+        model.pivot_columns = columns
+        pivot_apps.clear_cache()
+        _pivot_models[schema.table_id] = model
+    return model
+
+
+def forget_table(table_id):
+    with _pivot_models_lock:
+        model = _pivot_models.pop(table_id, None)
+        if model is not None:
+            pivot_apps.all_models[Cell._meta.app_label].pop(model._meta.model_name, None)
+            pivot_apps.clear_cache()
+
+
+def create_table(schema):
+    model = get_pivot_model(schema)
+    qn = connection.ops.quote_name
+    definitions = []
+    for field in model._meta.local_fields:
+        if field.primary_key:
+            definitions.append('%s %s NOT NULL PRIMARY KEY' % (qn(field.column), field.db_type(connection)))
+        else:
+            definitions.append('%s %s NULL' % (qn(field.column), field.db_type(connection)))
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE %s (%s)' % (qn(model._meta.db_table), ', '.join(definitions)))
+
+
+def drop_table(table_id):
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % connection.ops.quote_name(get_table_name(table_id)))
+    forget_table(table_id)
+
+
+def _get_pending():
+    # table id -> ids of the rows written since the columns of the table
+    # changed, in the transaction in progress. A table is pending as long as
+    # the callback of sync_columns_on_commit() is registered: not once the
+    # transaction, or the savepoint that registered it, rolls back.
+    from .django_dynamic_database import get_commit_keys
+
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = {}
+    if pending:
+        registered = get_commit_keys()
+        for table_id in list(pending):
+            if ('pivot', table_id) not in registered:
+                del pending[table_id]
+    return pending
+
+
+def is_pending(table_id):
+    return table_id in _get_pending()
+
+
+def is_materialized(schema):
+    """
+    Whether the table of schema is read from its pivot table: not by the
+    transaction that changes its columns, until it commits.
+    """
+    if not schema.materialized:
+        return False
+    check_settings()
+    return not is_pending(schema.table_id)
+
+
+def sync_columns_on_commit(table_id):
+    """
+    Apply the column changes of table_id to its pivot table when the
+    transaction in progress commits.
+    """
+    from .django_dynamic_database import on_commit_once
+
+    if connection.in_atomic_block:
+        _get_pending().setdefault(table_id, set())
+    on_commit_once(('pivot', table_id), partial(_sync_columns, table_id))
+
+
+def drop_table_on_commit(table_id):
+    transaction.on_commit(partial(drop_table, table_id))
+
+
+def _sync_columns(table_id):
+    from .django_dynamic_database import schema_registry
+
+    # Not in a transaction anymore: read the rows before _get_pending()
+    row_ids = getattr(_local, 'pending', {}).pop(table_id, None)
+    schema = schema_registry.get(table_id=table_id)
+    if schema is None or not schema.materialized:
+        return
+    with transaction.atomic():
+        sync_columns(schema)
+        if row_ids:
+            refresh_rows(schema, list(row_ids))
+
+
+def insert_rows(schema, row_ids=None):
+    """
+    Copy the pivot of the given rows (all the rows if None) into the table
+    with a single INSERT ... SELECT.
+    """
+    columns = get_columns(schema)
+    if not columns:
+        return
+    names = [name for pk, name, data_type in columns]
+    annotations = [(name, schema.annotations[name]) for name in names]
+    cells = Cell.objects.filter(table_id=schema.table_id)
+    if row_ids is not None:
+        cells = cells.filter(primary_key_id__in=row_ids)
+    # annotate() keeps the keyword order: the SELECT lists primary_key then
+    # the columns in the order of names.
+    pivot = cells.values('primary_key').annotate(**dict(annotations)).values_list('primary_key', *names).order_by()
+    sql, params = pivot.query.sql_with_params()
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO %s (%s) %s' % (
+            qn(get_table_name(schema.table_id)),
+            ', '.join([qn('id')] + [qn(get_column_name(pk)) for pk, name, data_type in columns]),
+            sql,
+        ), params)
+
+
+def delete_rows(schema, row_ids):
+    model = get_pivot_model(schema)
+    rows = model.objects.filter(id__in=row_ids)
+    rows._raw_delete(rows.db)
+
+
+def refresh_rows(schema, row_ids):
+    pending = _get_pending().get(schema.table_id)
+    if pending is not None:
+        # Refreshed once the columns are changed
+        pending.update(row_ids)
+        return
+    delete_rows(schema, row_ids)
+    insert_rows(schema, row_ids)
+
+
+def build(schema):
+    """
+    (Re)create the pivot table of schema and fill it from the cells.
+    """
+    drop_table(schema.table_id)
+    create_table(schema)
+    insert_rows(schema)
+
+
+def sync_columns(schema):
+    """
+    Bring the table in line with the columns of schema: new columns are
+    added in place, removed columns rebuild the table. A change of
+    Column.data_type needs an explicit build().
+    """
+    model = get_pivot_model(schema)
+    table_name = model._meta.db_table
+    with connection.cursor() as cursor:
+        if table_name not in connection.introspection.table_names(cursor):
+            return build(schema)
+        existing = set(col.name for col in connection.introspection.get_table_description(cursor, table_name))
+    fields = [field for field in model._meta.local_fields if not field.primary_key]
+    expected = set(field.column for field in fields)
+    if existing - expected - set(['id']):
+        return build(schema)
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for field in fields:
+            if field.column not in existing:
+                # New columns have no cells yet: NULL is their pivot value
+                cursor.execute('ALTER TABLE %s ADD COLUMN %s %s NULL' % (
+                    qn(table_name), qn(field.column), field.db_type(connection),
+                ))
+
+
+def materialize_table(table):
+    """
+    Turn the materialized pivot of table on and build it.
+    """
+    from .django_dynamic_database import schema_registry
+
+    check_settings()
+    table.materialized = True
+    table.save()
+    build(schema_registry.get(table_id=table.pk))
+
+
+def dematerialize_table(table):
+    table.materialized = False
+    table.save()
+    drop_table(table.pk)
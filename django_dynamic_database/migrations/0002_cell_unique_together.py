@@ -0,0 +1,40 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_cells(apps, schema_editor):
+    # Older versions of DynamicDBModel.save() inserted a new cell on every
+    # update: keep the latest cell of each (row, column) pair.
+    Cell = apps.get_model('django_dynamic_database', 'Cell')
+    duplicates = (
+        Cell.objects.values('primary_key', 'value_type')
+        .annotate(count=Count('id'), last_id=Max('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for dup in duplicates.iterator():
+        Cell.objects.filter(
+            primary_key=dup['primary_key'],
+            value_type=dup['value_type'],
+            id__lt=dup['last_id'],
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dynamic_database', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cell',
+            name='value',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.RunPython(remove_duplicate_cells, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cell',
+            unique_together={('primary_key', 'value_type')},
+        ),
+    ]
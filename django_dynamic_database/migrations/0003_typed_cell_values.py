@@ -0,0 +1,45 @@
+# Generated by Django 2.1.15 on 2026-10-17 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dynamic_database', '0002_cell_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cell',
+            name='date_value',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='datetime_value',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='num_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='column',
+            name='data_type',
+            field=models.CharField(choices=[('text', 'Text'), ('integer', 'Integer'), ('float', 'Float'), ('date', 'Date'), ('datetime', 'Date and time')], default='text', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['value_type', 'num_value'], name='ddb_cell_num_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['value_type', 'date_value'], name='ddb_cell_date_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['value_type', 'datetime_value'], name='ddb_cell_datetime_value_idx'),
+        ),
+    ]
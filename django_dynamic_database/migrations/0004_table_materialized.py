@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dynamic_database', '0003_typed_cell_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='materialized',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dynamic_database', '0004_table_materialized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='row',
+            name='data',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,133 @@
+from django.db import migrations, models, transaction
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+import django.db.models.deletion
+
+
+# Cells updated per transaction by the backfill
+CHUNK_SIZE = 10000
+
+
+# On PostgreSQL the steps below that would scan Cell under a lock blocking
+# the writes run online instead: the column is added nullable, its foreign
+# key NOT VALID then validated apart, its indexes are built CONCURRENTLY, and
+# NOT NULL is proven by a CHECK validated apart, which PostgreSQL 12 and
+# later use to set it without a scan (PostgreSQL 11 still scans Cell under an
+# ACCESS EXCLUSIVE lock). ADD COLUMN and SET NOT NULL take an ACCESS
+# EXCLUSIVE lock for an instant. Table holds one row per dynamic table: its
+# unique constraint is built at once. The other databases run the plain
+# operations.
+
+def is_postgresql(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def create_index_concurrently(schema_editor, statement):
+    schema_editor.execute(str(statement).replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1))
+
+
+class AddForeignKeyOnline(migrations.AddField):
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super(AddForeignKeyOnline, self).database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        field = model._meta.get_field(self.name)
+        qn = schema_editor.quote_name
+        schema_editor.execute('ALTER TABLE %s ADD COLUMN %s %s NULL' % (
+            qn(model._meta.db_table), qn(field.column), field.db_type(schema_editor.connection),
+        ))
+        schema_editor.execute('%s NOT VALID' % schema_editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+        for name in schema_editor._constraint_names(model, [field.column], foreign_key=True):
+            schema_editor.execute('ALTER TABLE %s VALIDATE CONSTRAINT %s' % (qn(model._meta.db_table), qn(name)))
+        create_index_concurrently(schema_editor, schema_editor._create_index_sql(model, [field]))
+
+
+class SetNotNullOnline(migrations.AlterField):
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super(SetNotNullOnline, self).database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        column = model._meta.get_field(self.name).column
+        qn = schema_editor.quote_name
+        table = qn(model._meta.db_table)
+        check = qn('ddb_cell_table_not_null')
+        schema_editor.execute('ALTER TABLE %s ADD CONSTRAINT %s CHECK (%s IS NOT NULL) NOT VALID' % (table, check, qn(column)))
+        schema_editor.execute('ALTER TABLE %s VALIDATE CONSTRAINT %s' % (table, check))
+        schema_editor.execute('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL' % (table, qn(column)))
+        schema_editor.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (table, check))
+
+
+class AddIndexOnline(migrations.AddIndex):
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super(AddIndexOnline, self).database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        create_index_concurrently(schema_editor, self.index.create_sql(model, schema_editor))
+
+
+def backfill_cell_table(apps, schema_editor):
+    # Copy Row.table_id into the cells in chunks of ids, each in its own
+    # transaction, so that the table is never locked as a whole.
+    Cell = apps.get_model('django_dynamic_database', 'Cell')
+    Row = apps.get_model('django_dynamic_database', 'Row')
+    db_alias = schema_editor.connection.alias
+    bounds = Cell.objects.using(db_alias).aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return
+    table_id = Subquery(Row.objects.filter(pk=OuterRef('primary_key_id')).values('table_id')[:1])
+    for start in range(bounds['low'], bounds['high'] + 1, CHUNK_SIZE):
+        with transaction.atomic(using=db_alias):
+            Cell.objects.using(db_alias).filter(
+                id__gte=start, id__lt=start + CHUNK_SIZE, table__isnull=True,
+            ).update(table_id=table_id)
+
+
+def check_table_names(apps, schema_editor):
+    Table = apps.get_model('django_dynamic_database', 'Table')
+    duplicates = list(
+        Table.objects.using(schema_editor.connection.alias).values('name')
+        .annotate(count=Count('id')).filter(count__gt=1).values_list('name', flat=True).order_by()
+    )
+    if duplicates:
+        raise RuntimeError('Table names must be unique, rename the tables named: %s.' % ', '.join(duplicates))
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits chunk by chunk, and CREATE INDEX CONCURRENTLY runs
+    # outside of a transaction
+    atomic = False
+
+    dependencies = [
+        ('django_dynamic_database', '0005_row_data'),
+    ]
+
+    operations = [
+        AddForeignKeyOnline(
+            model_name='cell',
+            name='table',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='django_dynamic_database.Table'),
+        ),
+        migrations.RunPython(backfill_cell_table, migrations.RunPython.noop),
+        SetNotNullOnline(
+            model_name='cell',
+            name='table',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='django_dynamic_database.Table'),
+        ),
+        AddIndexOnline(
+            model_name='cell',
+            index=models.Index(fields=['table', 'primary_key', 'value_type'], name='ddb_cell_table_row_idx'),
+        ),
+        AddIndexOnline(
+            model_name='cell',
+            index=models.Index(fields=['value_type', 'value'], name='ddb_cell_value_idx'),
+        ),
+        migrations.RunPython(check_table_names, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='table',
+            name='name',
+            field=models.CharField(max_length=30, unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dynamic_database', '0006_cell_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='modified',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='table',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
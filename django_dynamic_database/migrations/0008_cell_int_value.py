@@ -0,0 +1,155 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:52
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import Case, F, Max, Min, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+# Ids of cells per UPDATE of the backfill, two parameters each: under the
+# 999 parameters of SQLite
+CHUNK_SIZE = 400
+
+# Cell field holding the typed copy of the value, by Column.data_type
+TYPED_VALUE_FIELDS = {
+    'integer': 'int_value',
+    'float': 'num_value',
+    'date': 'date_value',
+    'datetime': 'datetime_value',
+}
+
+# The helpers below are copies of those of django_dynamic_database.py as of
+# this migration: later changes of the app must not change what it does.
+
+# Column.data_type of the model fields
+FIELD_DATA_TYPES = {
+    'IntegerField': 'integer',
+    'BigIntegerField': 'integer',
+    'SmallIntegerField': 'integer',
+    'PositiveIntegerField': 'integer',
+    'PositiveSmallIntegerField': 'integer',
+    'FloatField': 'float',
+    'DecimalField': 'float',
+    'DateField': 'date',
+    'DateTimeField': 'datetime',
+}
+
+first_cap_re = re.compile('(.)([A-Z][a-z]+)')
+all_cap_re = re.compile('([a-z0-9])([A-Z])')
+
+
+def convert(name):
+    # Table name of a model name
+    s1 = first_cap_re.sub(r'\1_\2', name)
+    return all_cap_re.sub(r'\1_\2', s1).lower()
+
+
+def to_typed_value(data_type, val):
+    if val is None or val == '':
+        return None
+    if data_type == 'integer':
+        try:
+            return int(val)
+        except ValueError:
+            # '2.0'
+            return int(float(val))
+    if data_type == 'float':
+        return float(val)
+    if data_type == 'date':
+        return parse_date(str(val))
+    if data_type == 'datetime':
+        val = parse_datetime(str(val))
+        if val is not None and settings.USE_TZ and timezone.is_naive(val):
+            val = timezone.make_aware(val)
+        return val
+    return str(val)
+
+
+def backfill_column_data_types(apps, schema_editor):
+    # The columns created before Column.data_type are 'text': give them the
+    # type of the field of the same name of the model of their table, for
+    # the models of the migration state.
+    Column = apps.get_model('django_dynamic_database', 'Column')
+    Table = apps.get_model('django_dynamic_database', 'Table')
+    db_alias = schema_editor.connection.alias
+    table_ids = dict(Table.objects.using(db_alias).values_list('name', 'pk'))
+    for model in apps.get_models():
+        table_id = table_ids.get(convert(model.__name__))
+        if model._meta.app_label == 'django_dynamic_database' or table_id is None:
+            continue
+        for field in model._meta.concrete_fields:
+            data_type = FIELD_DATA_TYPES.get(field.get_internal_type())
+            if data_type is None or field.primary_key or field.is_relation:
+                continue
+            Column.objects.using(db_alias).filter(
+                table_id=table_id, name=field.name, data_type='text',
+            ).update(data_type=data_type)
+
+
+def backfill_typed_values(apps, schema_editor):
+    # Fill the typed copy of the cells of the typed columns from their value,
+    # parsed as the writes do, in chunks of ids each in its own transaction.
+    # Integers move from num_value to int_value.
+    Cell = apps.get_model('django_dynamic_database', 'Cell')
+    Column = apps.get_model('django_dynamic_database', 'Column')
+    db_alias = schema_editor.connection.alias
+    for data_type, field in TYPED_VALUE_FIELDS.items():
+        column_ids = list(Column.objects.using(db_alias).filter(data_type=data_type).values_list('pk', flat=True))
+        if not column_ids:
+            continue
+        output_field = Cell._meta.get_field(field)
+        cells = Cell.objects.using(db_alias).filter(
+            value_type_id__in=column_ids, value__isnull=False, **{field + '__isnull': True}
+        )
+        bounds = cells.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            continue
+        for start in range(bounds['low'], bounds['high'] + 1, CHUNK_SIZE):
+            with transaction.atomic(using=db_alias):
+                chunk = cells.filter(id__gte=start, id__lt=start + CHUNK_SIZE)
+                whens = []
+                for pk, value in chunk.values_list('id', 'value'):
+                    try:
+                        typed = to_typed_value(data_type, value)
+                    except (TypeError, ValueError):
+                        typed = None
+                    if typed is not None:
+                        whens.append(When(id=pk, then=Value(typed, output_field=output_field)))
+                if not whens:
+                    continue
+                updates = {field: Case(*whens, default=F(field), output_field=output_field)}
+                if field == 'int_value':
+                    updates['num_value'] = None
+                chunk.update(**updates)
+
+
+def restore_num_values(apps, schema_editor):
+    Cell = apps.get_model('django_dynamic_database', 'Cell')
+    Cell.objects.using(schema_editor.connection.alias).filter(int_value__isnull=False).update(num_value=F('int_value'))
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits chunk by chunk
+    atomic = False
+
+    dependencies = [
+        ('django_dynamic_database', '0007_table_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cell',
+            name='int_value',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_column_data_types, migrations.RunPython.noop),
+        migrations.RunPython(backfill_typed_values, restore_num_values),
+        migrations.AddIndex(
+            model_name='cell',
+            index=models.Index(fields=['value_type', 'int_value'], name='ddb_cell_int_value_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dynamic_database', '0008_cell_int_value'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='drop_heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='table',
+            name='dropped_cells',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='table',
+            name='dropped_rows',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -2,7 +2,18 @@ from django.db import models
 
 class Table(models.Model):
 
-    name = models.CharField(max_length=30)
+    name = models.CharField(max_length=30, unique=True)
+    # Keep a wide copy of the pivot in its own table (see materialized.py)
+    materialized = models.BooleanField(default=False)
+    # Change stamp of the table, its columns and its rows, bumped by every
+    # write (see receivers.py) and used for the ETag of the REST views
+    version = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField(null=True, blank=True)
+    # Progress of the drop of the table in batches, shared by the processes
+    # (see drops.py): set while a job drops it, refreshed after each batch
+    drop_heartbeat = models.DateTimeField(null=True, blank=True)
+    dropped_cells = models.BigIntegerField(default=0)
+    dropped_rows = models.BigIntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -11,8 +22,22 @@ class Table(models.Model):
 
 class Column(models.Model):
 
+    TEXT = 'text'
+    INTEGER = 'integer'
+    FLOAT = 'float'
+    DATE = 'date'
+    DATETIME = 'datetime'
+    DATA_TYPES = (
+        (TEXT, 'Text'),
+        (INTEGER, 'Integer'),
+        (FLOAT, 'Float'),
+        (DATE, 'Date'),
+        (DATETIME, 'Date and time'),
+    )
+
     name = models.CharField(max_length=100)
     table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='columns')
+    data_type = models.CharField(max_length=10, choices=DATA_TYPES, default=TEXT)
     
     def __str__(self):
         return self.name
@@ -23,6 +48,9 @@ class Row(models.Model):
 
     table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='rows')
     cells = models.ManyToManyField(Column, through='Cell', related_name='+')
+    # JSON document of the cells keyed by column id, kept in sync when
+    # DYNAMIC_DATABASE_ROW_DATA is set (see documents.py)
+    data = models.TextField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -31,8 +59,26 @@ class Row(models.Model):
 
 class Cell(models.Model):
 
+    # Table of the row, copied so that the pivot filters Cell alone
+    table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='cells')
     primary_key = models.ForeignKey('Row', on_delete=models.CASCADE)
     value_type = models.ForeignKey('Column', on_delete=models.CASCADE)
     value = models.CharField(max_length=500, null=True, blank=True)
+    # Typed copies of value, filled according to value_type.data_type
+    int_value = models.BigIntegerField(null=True, blank=True)
+    num_value = models.FloatField(null=True, blank=True)
+    date_value = models.DateField(null=True, blank=True)
+    datetime_value = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('primary_key', 'value_type')
+        indexes = [
+            models.Index(fields=['table', 'primary_key', 'value_type'], name='ddb_cell_table_row_idx'),
+            models.Index(fields=['value_type', 'value'], name='ddb_cell_value_idx'),
+            models.Index(fields=['value_type', 'int_value'], name='ddb_cell_int_value_idx'),
+            models.Index(fields=['value_type', 'num_value'], name='ddb_cell_num_value_idx'),
+            models.Index(fields=['value_type', 'date_value'], name='ddb_cell_date_value_idx'),
+            models.Index(fields=['value_type', 'datetime_value'], name='ddb_cell_datetime_value_idx'),
+        ]
 
 
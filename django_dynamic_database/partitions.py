@@ -0,0 +1,127 @@
+"""
+
+Cell partitioned by table, on PostgreSQL 11 and later.
+
+The partition_cells command turns Cell into a table partitioned by LIST
+(table_id), with one partition per Table, django_dynamic_database_cell_p<table
+id>, and a default partition. With DYNAMIC_DATABASE_PARTITION_CELLS set, once
+the command has run, a partition is created with each Table and dropped with
+it (see receivers.py): deleting a table drops its cells at once instead of
+deleting them one by one.
+
+The queries of the dynamic tables filter Cell on table_id, so PostgreSQL
+reads the partition of the table only. The primary key of a partitioned table
+includes the partition key: it becomes (id, table_id), and the unique
+(primary_key, value_type) constraint becomes (table_id, primary_key,
+value_type).
+
+The layout is kept out of the migrations: run the command again after a
+migration that rebuilds Cell.
+
+"""
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Table, Cell
+
+
+UNIQUE_INDEX = 'ddb_cell_table_row_col_uniq'
+
+
+def is_enabled():
+    return getattr(settings, 'DYNAMIC_DATABASE_PARTITION_CELLS', False) and connection.vendor == 'postgresql'
+
+
+def is_active():
+    """
+    Whether a partition is kept per table: the setting is on and
+    partition_cells has run.
+    """
+    return is_enabled() and is_partitioned()
+
+
+def get_partition_name(table_id):
+    return '%s_p%s' % (Cell._meta.db_table, table_id)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s AND pg_table_is_visible(c.oid)', [Cell._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def has_partition(table_id):
+    """
+    Whether Cell is partitioned and table_id has its own partition.
+    """
+    if not is_partitioned():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_class WHERE relname = %s AND pg_table_is_visible(oid)', [get_partition_name(table_id)],
+        )
+        return cursor.fetchone() is not None
+
+
+def create_partition(table_id):
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES IN (%d)' % (
+            qn(get_partition_name(table_id)), qn(Cell._meta.db_table), int(table_id),
+        ))
+
+
+def drop_partition(table_id):
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % connection.ops.quote_name(get_partition_name(table_id)))
+
+
+def partition_cells():
+    """
+    Rebuild Cell as a table partitioned by table_id and copy the cells into
+    it, in one transaction. Return the number of partitions.
+    """
+    if connection.vendor != 'postgresql' or connection.pg_version < 110000:
+        raise ValueError('Partitioning Cell needs PostgreSQL 11 or later.')
+    if is_partitioned():
+        raise ValueError('Cell is already partitioned.')
+    qn = connection.ops.quote_name
+    table = Cell._meta.db_table
+    old = '%s_unpartitioned' % table
+    fields = dict((field.name, field) for field in Cell._meta.concrete_fields)
+    table_ids = list(Table.objects.order_by('pk').values_list('pk', flat=True))
+    with transaction.atomic(), connection.schema_editor() as schema_editor:
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE %s RENAME TO %s' % (qn(table), qn(old)))
+            cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY LIST (%s)' % (
+                qn(table), qn(old), qn(fields['table'].column),
+            ))
+            # The id sequence would be dropped with the old table
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [old])
+            sequence = cursor.fetchone()[0]
+            cursor.execute('ALTER SEQUENCE %s OWNED BY %s.%s' % (sequence, qn(table), qn('id')))
+            for table_id in table_ids:
+                create_partition(table_id)
+            cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (qn('%s_default' % table), qn(table)))
+            cursor.execute('INSERT INTO %s SELECT * FROM %s' % (qn(table), qn(old)))
+            cursor.execute('DROP TABLE %s' % qn(old))
+            # Constraints and indexes of the parent apply to every partition
+            cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (%s, %s)' % (qn(table), qn('id'), qn(fields['table'].column)))
+            cursor.execute('CREATE UNIQUE INDEX %s ON %s (%s, %s, %s)' % (
+                qn(UNIQUE_INDEX), qn(table),
+                qn(fields['table'].column), qn(fields['primary_key'].column), qn(fields['value_type'].column),
+            ))
+        for name in ('table', 'primary_key', 'value_type'):
+            field = fields[name]
+            schema_editor.execute(schema_editor._create_fk_sql(
+                Cell, field, '_fk_%(to_table)s_%(to_column)s',
+            ))
+            schema_editor.execute(schema_editor._create_index_sql(Cell, [field]))
+        for index in Cell._meta.indexes:
+            schema_editor.execute(index.create_sql(Cell, schema_editor))
+    return len(table_ids)
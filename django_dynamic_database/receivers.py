@@ -0,0 +1,110 @@
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import documents, materialized, partitions
+from .models import Table, Column
+from .signals import post_rows_save, pre_rows_delete
+from .django_dynamic_database import result_cache, schema_registry, touch_table
+
+
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
+def invalidate_table_schema(sender, instance, **kwargs):
+    # The table may have been renamed: drop the entry by id and by name
+    schema_registry.invalidate(table_id=instance.pk, table_name=instance.name)
+
+
+@receiver(post_save, sender=Column)
+@receiver(post_delete, sender=Column)
+def invalidate_column_schema(sender, instance, **kwargs):
+    schema_registry.invalidate(table_id=instance.table_id)
+
+
+# Change stamp of the tables. Table.save() writes the version it read: it
+# is bumped after it.
+
+@receiver(post_rows_save)
+@receiver(pre_rows_delete)
+def touch_rows_table(sender, table_id, **kwargs):
+    touch_table(table_id)
+
+
+@receiver(post_save, sender=Column)
+@receiver(post_delete, sender=Column)
+def touch_column_table(sender, instance, **kwargs):
+    touch_table(instance.table_id)
+
+
+@receiver(post_save, sender=Table)
+def touch_saved_table(sender, instance, **kwargs):
+    touch_table(instance.pk)
+
+
+# Materialized pivot. Connected after the schema invalidation receivers
+# so that they see the new columns. The tables are altered and dropped when
+# the transaction commits.
+
+@receiver(post_rows_save)
+def refresh_materialized_rows(sender, table_id, row_ids, **kwargs):
+    schema = schema_registry.get(table_id=table_id)
+    if schema is not None and schema.materialized:
+        materialized.refresh_rows(schema, row_ids)
+
+
+@receiver(pre_rows_delete)
+def delete_materialized_rows(sender, table_id, row_ids, **kwargs):
+    schema = schema_registry.get(table_id=table_id)
+    if schema is not None and schema.materialized:
+        materialized.delete_rows(schema, row_ids)
+
+
+@receiver(post_save, sender=Column)
+@receiver(post_delete, sender=Column)
+def sync_materialized_columns(sender, instance, **kwargs):
+    schema = schema_registry.get(table_id=instance.table_id)
+    if schema is not None and schema.materialized:
+        materialized.sync_columns_on_commit(instance.table_id)
+
+
+@receiver(post_delete, sender=Table)
+def drop_materialized_table(sender, instance, **kwargs):
+    if instance.materialized:
+        materialized.drop_table_on_commit(instance.pk)
+
+
+# Partitions of Cell. The partition is dropped before the cascade deletes
+# the cells of the table, which then finds none.
+
+@receiver(post_save, sender=Table)
+def create_cell_partition(sender, instance, created, **kwargs):
+    if created and partitions.is_active():
+        partitions.create_partition(instance.pk)
+
+
+@receiver(pre_delete, sender=Table)
+def drop_cell_partition(sender, instance, **kwargs):
+    if partitions.is_active():
+        partitions.drop_partition(instance.pk)
+
+
+# JSON documents of the rows
+
+@receiver(post_rows_save)
+def refresh_row_data(sender, table_id, row_ids, **kwargs):
+    if documents.is_enabled():
+        documents.refresh_rows(table_id, row_ids)
+
+
+# Result cache. The version is bumped when the transaction commits: results
+# read in between by other connections are the old ones.
+
+@receiver(post_rows_save)
+@receiver(pre_rows_delete)
+def invalidate_rows_results(sender, table_id, **kwargs):
+    result_cache.invalidate(table_id)
+
+
+@receiver(post_save, sender=Column)
+@receiver(post_delete, sender=Column)
+def invalidate_column_results(sender, instance, **kwargs):
+    result_cache.invalidate(instance.table_id)
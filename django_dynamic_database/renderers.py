@@ -0,0 +1,23 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import renderers
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Newline delimited JSON: one JSON document per line.
+    Lets clients negotiate 'Accept: application/x-ndjson' on the row views.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and isinstance(data.get('data'), list):
+            data = data['data']
+        if not isinstance(data, list):
+            data = [data]
+        return ''.join(json.dumps(obj, cls=DjangoJSONEncoder) + '\n' for obj in data).encode(self.charset)
@@ -1,12 +1,18 @@
 import itertools
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.fields import empty
 from rest_framework.exceptions import ErrorDetail, ValidationError
 
 
-from .django_dynamic_database import convert, DynamicDBModelQuerySet
+from .django_dynamic_database import (
+    convert, convert_cells, insert_row, make_cell, schema_registry, upsert_cells, DictObj,
+    DynamicDBModelQuerySet,
+)
 from .models import Table, Column, Row, Cell
+from . import drops
+from .signals import post_rows_save
 
 
 
@@ -21,7 +27,7 @@ class ColumnSerializer(serializers.ModelSerializer):
     id = serializers.ModelField(model_field=Column._meta.get_field('id'), required=False)
     class Meta:
         model = Column
-        fields = ('id', 'name')
+        fields = ('id', 'name', 'data_type')
 
 
 class TableSerializer(serializers.ModelSerializer):
@@ -61,10 +67,15 @@ class TableSerializer(serializers.ModelSerializer):
                 col = [x for x in columns if x.id == col_data.get('id')]
                 if len(col) > 0:
                     column = Column.objects.get(id=col[0].id)
+                    data_type = column.data_type
                     for field in col_data:
                         column.__setattr__(field, col_data.get(field))
                         column.table = instance
-                    column.save()
+                    with transaction.atomic():
+                        column.save()
+                        # The typed values of the cells follow the new type
+                        if column.data_type != data_type:
+                            convert_cells(column, column.data_type)
                     not_to_delete.append(col[0].id)
                 else:
                     Column.objects.create(table = instance, **col_data)
@@ -74,7 +85,7 @@ class TableSerializer(serializers.ModelSerializer):
         if columns:
             for col in columns:
                 if col.id not in not_to_delete:
-                    Column.objects.filter(id=col.id).delete()
+                    drops.drop_column(col)
         return instance
 
 
@@ -100,65 +111,46 @@ class DataRowsSerializer(serializers.ModelSerializer):
         column_names = [k for k, v in annotations]
         values = DynamicDBModelQuerySet(self)._get_query_values(column_names)
         
-        qs = Cell.objects.filter(primary_key__table__name=table_name).values('primary_key').annotate(**annotations).values(**values).order_by()
+        schema = schema_registry.get(table_name=table_name)
+        qs = Cell.objects.filter(table_id=schema.table_id if schema is not None else None).values('primary_key').annotate(**annotations).values(**values).order_by()
         
         return JsonResponse(serializers.serialize("json", qs))
 
     def create(self, validated_data):
         # validated_data = {table_id, others rows fields}
-        defaults = None
-        objs = []
         table_id = validated_data.pop('table_id')
-        table_obj = Table.objects.get(pk=table_id)
-        
-        if table_obj:
-            # Create row to initialize pk
-            row_obj = Row.objects.create(table=table_obj)
-            
-            if row_obj is not None:
-                annotations = DynamicDBModelQuerySet(self)._get_custom_annotation(table_name=table_obj.name)
-                
-                column_names = [k for k, v in annotations]
-                
-                defaults = column_names
-                
-                for attr, val in list(validated_data.items()):
-                    defaults.pop(attr)
-                    col_obj = Column.objects.get(table=table_obj, name=attr)
-                    objs.append(Cell(primary_key=row_obj, value_type=col_obj, value=str(val)))
-                
-                for attr in defaults:
-                    col_obj = Column.objects.get(table=table_obj, name=attr)
-                    objs.append(Cell(primary_key=row_obj, value_type=col_obj, value=null))
-                
-                Cell.objects.bulk_create(objs)
-                
-                # Initialize annotations and values to return query_set from pivot
-                values = DynamicDBModelQuerySet(self)._get_query_values(column_names)
-                
-                try:
-                    obj = Cell.objects.values('primary_key').annotate(**annotations).filter(primary_key=row_obj).values(**values).order_by()
-                    # Converting value_query_set to object
-                    res = DynamicDBModelQuerySet(self)._dict_to_object(obj[0])
-                    return res
-                except ValueError:
-                    # raise("Please check yours fields values")
-                    raise serializers.ValidationError('Please check yours fields values.')
+        schema = schema_registry.get(table_id=table_id)
+        if schema is None:
+            raise serializers.ValidationError('Table %s does not exist.' % table_id)
+        try:
+            row = insert_row(schema, validated_data)
+        except ValueError:
+            raise serializers.ValidationError('Please check yours fields values.')
+        # Converting the row to object
+        return DictObj(row)
 
     def update(self, instance, validated_data):
         
         row_id = validated_data.get('id')
             
         table_id = validated_data.get('table_id')
-        table_obj = Table.objects.get(pk=table_id)
+        schema = schema_registry.get(table_id=table_id)
+        if schema is None:
+            raise serializers.ValidationError('Table %s does not exist.' % table_id)
+        values = dict((attr, val) for attr, val in validated_data.items() if attr not in ('id', 'table_id'))
+        unknown = [attr for attr in values if attr not in schema.column_ids]
+        if unknown:
+            raise serializers.ValidationError('Unknown columns: %s.' % ', '.join(sorted(unknown)))
         
         for field in validated_data:
             instance.__setattr__(field, validated_data.get(field))
     
-        for attr, val in validated_data.items():
-            qs = Cell.objects.filter(primary_key__table=table_obj, primary_key__id=row_id, value_type=Column.objects.get(table=table_obj, name=attr)).update(value=val)
+        # The cells and the document of the row change together
+        with transaction.atomic():
+            upsert_cells([
+                make_cell(schema.table_id, row_id, schema.column_ids[attr], schema.data_types[attr], val)
+                for attr, val in values.items()
+            ])
+            post_rows_save.send(sender=Table, table_id=schema.table_id, row_ids=[row_id])
             
         return instance
-
-
-
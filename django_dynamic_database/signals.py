@@ -0,0 +1,18 @@
+from django.dispatch import Signal
+
+
+# Sent after rows of a dynamic table were written, inside the same
+# transaction. sender is the DynamicDBModel class, or Table for rows written
+# through the REST API; row_ids is a list of Row ids, or a queryset of them
+# for set-based writes, which reads a temporary table: evaluate it before
+# the receiver returns.
+post_rows_save = Signal(providing_args=['table_id', 'row_ids'])
+
+# Sent before rows of a dynamic table are deleted, while their cells can
+# still be read.
+pre_rows_delete = Signal(providing_args=['table_id', 'row_ids'])
+
+# Sent after an instrumented operation when DYNAMIC_DATABASE_INSTRUMENTATION
+# is set (see instrumentation.py). stats holds queries, sql_time,
+# python_time and rows.
+operation_finished = Signal(providing_args=['operation', 'stats'])
@@ -1,12 +1,31 @@
 from __future__ import absolute_import
+import csv
 import datetime
+import json
+import os
+import tempfile
+from unittest import mock
+from io import BytesIO, StringIO
 
-from django.test import TestCase, Client, RequestFactory, override_settings
+from django.core.exceptions import FieldError, ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.db import models
+from django.db.models import Q
+from django_dynamic_database import drops, exports, materialized, partitions
 from django_dynamic_database.models import Table, Row, Column, Cell
-from django_dynamic_database.django_dynamic_database import DynamicDBModel
+from django_dynamic_database.signals import operation_finished, post_rows_save
+from django_dynamic_database.materialized import get_table_name
+from django_dynamic_database.serializers import DataRowsSerializer
+from django_dynamic_database.django_dynamic_database import (
+    DictObj, DynamicDBModel, DynamicDBModelQuerySet, PivotCompiler, PostgreSQLPivotCompiler, get_pivot_compiler,
+    insert_row, result_cache, schema_registry,
+)
 
 from django.contrib.auth.models import User
 
@@ -20,6 +39,9 @@ class KingBook(DynamicDBModel):
 class DynamicDBModelModelTests(TestCase):
 
     def setUp(self):
+        # Test transactions are rolled back without sending signals
+        schema_registry.clear()
+
         # Every test needs access to the request factory.
         self.factory = RequestFactory()
         
@@ -58,7 +80,7 @@ class DynamicDBModelModelTests(TestCase):
             for row in range(number_of_rows):
                 r = Row.objects.create(table=t)
                 for col in t.columns.all():
-                    cells.append(Cell(primary_key=r, value_type=col, value="value " + str(col.id)))
+                    cells.append(Cell(table=t, primary_key=r, value_type=col, value="value " + str(col.id)))
         Cell.objects.bulk_create(cells)
 
 
@@ -76,6 +98,10 @@ class DynamicDBModelModelTests(TestCase):
         
         self.assertEqual(bk1.__class__.__name__, "KingBook")
         self.assertEqual(bk2.name, "John Wick")
+        # One slotted class per model, shared by its rows
+        self.assertIs(type(bk1), type(bk2))
+        self.assertFalse(hasattr(bk1, '__dict__'))
+        self.assertEqual(DictObj.__name__, "DictObj")
         # self.assertEqual(bk3.rate, 1.0)
 
         # Support MyModel.objects.get()
@@ -101,14 +127,14 @@ class DynamicDBModelModelTests(TestCase):
         # Support default value
         bk9 = KingBook.objects.get(id=64)
         self.assertEqual(bk9.name, "Brad Pete")
-        self.assertEqual(bk9.rate, '1.0')
-        self.assertEqual(bk9.weight, 'None')
+        self.assertEqual(bk9.rate, 1.0)
+        self.assertEqual(bk9.weight, None)
 
         # Support instance update
         bk9.rate = 1.33
         bk9.save()
         bk10 = KingBook.objects.get(name="Brad Pete")
-        self.assertEqual(bk10.rate, '1.33')
+        self.assertEqual(bk10.rate, 1.33)
 
         # Support complex filter
         bk11 = KingBook.objects.filter(id__gt=62)
@@ -117,13 +143,12 @@ class DynamicDBModelModelTests(TestCase):
         
         # Support Aggregation
         higher_rate = KingBook.objects.aggregate(models.Max('rate'))
-        self.assertEqual(higher_rate, {'rate__max': '5'})
+        self.assertEqual(higher_rate, {'rate__max': 5.0})
         lower_rate = KingBook.objects.aggregate(models.Min('rate'))
-        self.assertEqual(lower_rate, {'rate__min': '1.33'})
+        self.assertEqual(lower_rate, {'rate__min': 1.33})
         
-        # SUM bugs with Postgres db
-        # sum_rate = KingBook.objects.aggregate(models.Sum('rate'))
-        # self.assertEqual(sum_rate, {'rate__sum': 13.33})
+        sum_rate = KingBook.objects.aggregate(models.Sum('rate'))
+        self.assertAlmostEqual(sum_rate['rate__sum'], 13.33)
         
         # Support delete()
         bk12 = KingBook.objects.create(name="Tony Stark2", rate=3.5)
@@ -135,14 +160,285 @@ class DynamicDBModelModelTests(TestCase):
         bk18 = KingBook.objects.create(name="John Wick6", rate=5)
         bk19 = KingBook.objects.create(name="John Wick7", rate=5)
 
-        deleted = KingBook.objects.get(name="John Wick6").delete()
-        
-        self.assertEqual(deleted, (8, {'django_dynamic_database.KingBook': 8}))
+        bk18 = KingBook.objects.get(name="John Wick6")
+        # Cells and Row of the entity only, in two DELETE statements
+        with CaptureQueriesContext(connection) as ctx:
+            deleted = bk18.delete()
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('DELETE')]), 2)
+        self.assertEqual(deleted, (1, {'django_dynamic_database.KingBook': 1}))
+        self.assertEqual(KingBook.objects.filter(rate=5).count(), 7)
+
+        # Without an id, the rows matching all of the values are deleted
+        self.assertEqual(KingBook(name="John Wick7", rate=5).delete(), (1, {'django_dynamic_database.KingBook': 1}))
+        self.assertEqual(KingBook(name="John Wick7", rate=5).delete(), (0, {'django_dynamic_database.KingBook': 0}))
         
         # Support update()
         bk20 = KingBook.objects.filter(id__lt=66).update(rate=1.5)
         bk12 = KingBook.objects.get(name="Tony Stark2")
-        self.assertEqual(bk12.rate, '1.5')
+        self.assertEqual(bk12.rate, 1.5)
+
+
+    def test_filter_pushdown(self):
+        KingBook.objects.create(name="Tony Stark", rate=3.5)
+        KingBook.objects.create(name="John Wick", rate=5)
+        KingBook.objects.create(name="John Doe", rate=2)
+
+        # Dynamic column lookups filter Cell before the GROUP BY
+        qs = KingBook.objects.filter(name="Tony Stark")
+        self.assertNotIn('HAVING', str(qs.query))
+        # Cells are filtered on their own table_id, without joining Row and Table
+        self.assertNotIn('JOIN', str(qs.query))
+        self.assertEqual([bk['name'] for bk in qs], ["Tony Stark"])
+
+        self.assertEqual(KingBook.objects.get(name="John Wick").rate, 5.0)
+        self.assertEqual(KingBook.objects.filter(name__startswith="John").count(), 2)
+        self.assertEqual(KingBook.objects.filter(name__in=["John Doe", "Tony Stark"]).count(), 2)
+        self.assertEqual(KingBook.objects.filter(name__startswith="John", rate="5").count(), 1)
+        self.assertEqual(KingBook.objects.filter(weight__isnull=True).count(), 3)
+        self.assertEqual(KingBook.objects.exclude(name="Tony Stark").count(), 2)
+        self.assertEqual(KingBook.objects.exclude(name__startswith="John", rate="5").count(), 2)
+
+        # Typed columns compare numerically
+        self.assertEqual(KingBook.objects.filter(rate__gt=3).count(), 2)
+        self.assertEqual(KingBook.objects.filter(rate__lt=10).count(), 3)
+        self.assertEqual([bk['rate'] for bk in KingBook.objects.order_by('rate')], [2.0, 3.5, 5.0])
+
+        # Other lookups are still applied on the pivot
+        self.assertEqual(KingBook.objects.filter(name__contains="Wick").count(), 1)
+        self.assertEqual(KingBook.objects.filter(name__startswith="John", name__contains="Doe").count(), 1)
+
+
+    def test_queryset_delete_update(self):
+        KingBook.objects.bulk_create([KingBook(name="Book %s" % i, rate=i) for i in range(10)])
+        # A row without cells, among the rows deleted below
+        empty = Row.objects.create(table=Table.objects.get(name="king_book"))
+        KingBook.objects.bulk_create([KingBook(name="Book %s" % i, rate=i) for i in range(10, 20)])
+        KingBook.objects.create(name="Tony Stark", rate=3.5)
+
+        # One UPDATE for all the columns, whatever the number of rows
+        with CaptureQueriesContext(connection) as ctx:
+            num = KingBook.objects.filter(rate__gte=10).update(rate=1.5, weight=2)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "django_dynamic_database_cell"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(num, 10)
+        self.assertEqual(KingBook.objects.filter(rate=1.5).count(), 10)
+        self.assertEqual(KingBook.objects.get(name="Book 12").weight, 2.0)
+        self.assertEqual(KingBook.objects.get(name="Book 2").weight, None)
+
+        # The cells the rows do not have are inserted
+        solo = KingBook.objects.create(name="Solo", rate=1)
+        Cell.objects.filter(primary_key_id=solo.id, value_type__name="weight").delete()
+        self.assertEqual(KingBook.objects.filter(name="Solo").update(weight=5), 1)
+        self.assertEqual(KingBook.objects.get(name="Solo").weight, 5.0)
+        self.assertEqual(KingBook.objects.filter(name="Solo").update(weight=None, rate=2), 1)
+        self.assertEqual((KingBook.objects.get(name="Solo").weight, KingBook.objects.get(name="Solo").rate), (None, 2.0))
+        KingBook.objects.filter(name="Solo").delete()
+
+        # The ids of the rows are staged in a temporary table, not inlined
+        self.assertIn('IN (SELECT id FROM "ddb_row_ids_0")', updates[0])
+
+        # Cells and Rows are deleted together, the ids staged once
+        with CaptureQueriesContext(connection) as ctx:
+            deleted = KingBook.objects.filter(name__startswith="Book").delete()
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]), 1)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('DELETE')]), 3)
+        self.assertEqual(deleted, (20, {'django_dynamic_database.KingBook': 20}))
+        self.assertEqual([bk['name'] for bk in KingBook.objects.all()], ["Tony Stark"])
+        self.assertEqual(list(Row.objects.filter(table__name="king_book", cell__isnull=True).values_list('pk', flat=True)), [empty.pk])
+        self.assertEqual(KingBook.objects.filter(name="Nobody").delete(), (0, {'django_dynamic_database.KingBook': 0}))
+
+
+    def test_json_rows(self):
+        KingBook.objects.create(name="Tony Stark", rate=3.5)
+        KingBook.objects.create(name="John Wick", rate=5)
+        KingBook.objects.create(name="John Doe", rate=2)
+
+        rows = list(KingBook.objects.json_rows().order_by('primary_key'))
+        self.assertEqual(rows, [
+            {'id': row['id'], 'name': row['name'], 'rate': row['rate'], 'weight': None}
+            for row in KingBook.objects.order_by('id')
+        ])
+        self.assertEqual([row['rate'] for row in rows], [3.5, 5.0, 2.0])
+
+        # Restricted to the requested columns, filtered on the cells
+        qs = KingBook.objects.json_rows('name', rate__gt=3)
+        self.assertEqual(sorted(row['name'] for row in qs), ["John Wick", "Tony Stark"])
+        self.assertEqual(set(qs[0]), {'id', 'name'})
+        self.assertEqual([row['name'] for row in KingBook.objects.json_rows('name', id=rows[2]['id'])], ["John Doe"])
+
+        # The statement does not grow with the number of columns
+        sql = str(KingBook.objects.json_rows().query)
+        self.assertEqual(sql.count('JSON_GROUP_OBJECT') if connection.vendor == 'sqlite' else 1, 1)
+        with self.assertRaises(FieldError):
+            KingBook.objects.json_rows('name', name__contains="Wick")
+
+
+    @override_settings(DYNAMIC_DATABASE_ROW_DATA=True)
+    def test_row_data(self):
+        bk1 = KingBook.objects.create(name="Tony Stark", rate=3.5)
+        bk2 = KingBook(name="John Wick", rate=5)
+        bk2.save()
+        KingBook.objects.bulk_create([KingBook(name="John Doe", rate=2)])
+        KingBook.objects.filter(rate__gt=4).update(rate=4.5)
+
+        # Primary key reads do not touch Cell
+        with CaptureQueriesContext(connection) as ctx:
+            bk = KingBook.objects.get(id=bk2.id)
+        self.assertNotIn('cell', ' '.join(q['sql'] for q in ctx.captured_queries))
+        self.assertEqual((bk.name, bk.rate, bk.weight), ("John Wick", 4.5, None))
+
+        out = StringIO()
+        call_command('build_row_data', 'king_book', '--verify', stdout=out)
+        self.assertIn('up to date', out.getvalue())
+
+        # Stale documents are reported, and rebuilt by the command
+        Row.objects.filter(pk=bk1.id).update(data=None)
+        Cell.objects.filter(primary_key_id=bk2.id, value_type__name='name').update(value="Jonathan Wick")
+        with self.assertRaisesMessage(CommandError, '2 stale documents'):
+            call_command('build_row_data', 'king_book', '--verify', stdout=StringIO())
+        self.assertEqual(KingBook.objects.get(id=bk1.id).name, "Tony Stark")
+        call_command('build_row_data', 'king_book', stdout=StringIO())
+        call_command('build_row_data', 'king_book', '--verify', stdout=StringIO())
+        self.assertEqual(KingBook.objects.get(id=bk2.id).name, "Jonathan Wick")
+
+        # The documents of the rows that leave the filter are rebuilt too
+        KingBook.objects.filter(rate__gt=4).update(rate=1)
+        self.assertEqual(KingBook.objects.get(id=bk2.id).rate, 1.0)
+
+        # The REST views read the documents, or the cells of the rows without one
+        t = Table.objects.get(name="king_book")
+        Row.objects.filter(pk=bk1.id).update(data=None)
+        response = self.client.get(reverse('table-rows', args=(t.id,)), {'limit': 2})
+        self.assertEqual([row['name'] for row in response.json()['data']], ["Tony Stark", "Jonathan Wick"])
+        response = self.client.post(reverse('table-rows', args=(t.id,)), {'name': "Will Smith", 'rate': 3})
+        row_id = response.json()['data'][0]['id']
+        response = self.client.get(reverse('table-row-details', args=(t.id, row_id)))
+        self.assertEqual(response.json()['data'], {'id': row_id, 'name': "Will Smith", 'rate': 3.0, 'weight': None})
+
+        # The serializer writes the cells and the document together, without
+        # a query per column
+        serializer = DataRowsSerializer()
+        with CaptureQueriesContext(connection) as ctx:
+            serializer.update(DictObj({}), {'id': row_id, 'table_id': t.id, 'name': "Will Smith Jr", 'weight': 80})
+        self.assertNotIn('django_dynamic_database_column', ' '.join(q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(KingBook.objects.get(id=row_id).weight, 80.0)
+
+        def fail(sender, **kwargs):
+            raise DatabaseError('Failed.')
+
+        post_rows_save.connect(fail)
+        try:
+            with self.assertRaises(DatabaseError):
+                serializer.update(DictObj({}), {'id': row_id, 'table_id': t.id, 'name': "Nobody"})
+        finally:
+            post_rows_save.disconnect(fail)
+        self.assertEqual(KingBook.objects.get(id=row_id).name, "Will Smith Jr")
+        self.assertEqual(Cell.objects.get(primary_key_id=row_id, value_type__name='name').value, "Will Smith Jr")
+
+        bk1.delete()
+        self.assertEqual(Row.objects.filter(table=t).count(), 3)
+
+
+    def test_column_pruning(self):
+        KingBook.objects.create(name="Tony Stark", rate=3.5, weight=80)
+        KingBook.objects.create(name="John Wick", rate=5)
+        schema = schema_registry.get(table_name="king_book")
+
+        # Only the cells of the requested columns are scanned and pivoted
+        qs = KingBook.objects.values('name', 'rate')
+        sql = str(qs.query)
+        self.assertIn('"value_type_id" IN (%s, %s)' % tuple(sorted((schema.column_ids['name'], schema.column_ids['rate']))), sql)
+        self.assertNotIn('%s THEN' % schema.column_ids['weight'], sql)
+        self.assertEqual(sorted(qs, key=lambda row: row['rate']), [
+            {'name': "Tony Stark", 'rate': 3.5}, {'name': "John Wick", 'rate': 5.0},
+        ])
+        self.assertEqual(sorted(KingBook.objects.values_list('name', flat=True)), ["John Wick", "Tony Stark"])
+        self.assertEqual(len(KingBook.objects.values_list('id', flat=True)), 2)
+
+        rows = list(KingBook.objects.only('weight').order_by('weight'))
+        self.assertEqual([set(row) for row in rows], [{'id', 'weight'}] * 2)
+        self.assertEqual([row['weight'] for row in rows], [None, 80.0])
+        self.assertEqual(set(KingBook.objects.defer('weight', 'rate')[0]), {'id', 'name'})
+        with self.assertRaises(FieldError):
+            KingBook.objects.only('nothing')
+
+        # Through filter(), with the filtered columns pivoted as well
+        qs = KingBook.objects.filter(rate__gt=4, name__contains="Wick").values('id', 'weight')
+        self.assertNotIn('%s THEN' % schema.column_ids['name'], str(qs.query).split('HAVING')[0])
+        self.assertEqual([set(row) for row in qs], [{'id', 'weight'}])
+        self.assertEqual(list(KingBook.objects.filter(weight__isnull=True).values_list('name', flat=True)), ["John Wick"])
+
+
+    def test_count_exists_fast_paths(self):
+        books = KingBook.objects.bulk_create([KingBook(name="Book %s" % i, rate=i) for i in range(10)])
+        ids = [bk.id for bk in books]
+
+        # Answered from Row, without the pivot GROUP BY
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(KingBook.objects.count(), 10)
+            self.assertTrue(KingBook.objects.exists())
+            self.assertEqual(KingBook.objects.filter(id__in=ids[:3]).count(), 3)
+            self.assertEqual(KingBook.objects.filter(rate__gte=5, id__lt=ids[7]).count(), 2)
+            self.assertFalse(KingBook.objects.filter(name="Nobody").exists())
+        self.assertEqual(len(ctx.captured_queries), 5)
+        self.assertNotIn('GROUP BY', ' '.join(q['sql'] for q in ctx.captured_queries))
+
+        # Lookups on the row id fetch the cells of the row only
+        qs = KingBook.objects.filter(id=ids[4])
+        self.assertIn('"primary_key_id" = %s' % ids[4], str(qs.query).split('GROUP BY')[0])
+        self.assertEqual(KingBook.objects.get(id=ids[4]).name, "Book 4")
+        self.assertEqual(KingBook.objects.get(pk=ids[5]).name, "Book 5")
+
+        # Lookups on the pivot still count the pivot
+        self.assertEqual(KingBook.objects.filter(name__contains="Book 1").count(), 1)
+
+
+    def test_pivot_compiler(self):
+        self.assertIs(type(get_pivot_compiler('mysql')), PivotCompiler)
+        self.assertIs(type(get_pivot_compiler('postgresql')), PostgreSQLPivotCompiler)
+        # MAX(value) FILTER (WHERE value_type_id = 1) on PostgreSQL
+        annotation = get_pivot_compiler('postgresql').get_annotation(1, Column.FLOAT)
+        self.assertEqual(annotation.filter, Q(value_type_id=1))
+        annotation = get_pivot_compiler('mysql').get_annotation(1, Column.TEXT)
+        sql = str(Cell.objects.values('primary_key').annotate(col=annotation).query)
+        self.assertIn('MAX(CASE WHEN', sql)
+        self.assertNotIn('GROUP_CONCAT', sql)
+
+
+    def test_bulk_create(self):
+        books = [KingBook(name="Book %s" % i, rate=i) for i in range(50)]
+        KingBook.objects.create(name="Tony Stark", rate=3.5)
+
+        with CaptureQueriesContext(connection) as ctx:
+            created = KingBook.objects.bulk_create(books, batch_size=40)
+        # Rows in one insert, cells in chunks of batch_size
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+
+        self.assertEqual(KingBook.objects.count(), 51)
+        self.assertEqual(len(set(bk.id for bk in created)), 50)
+        bk = KingBook.objects.get(id=created[7].id)
+        self.assertEqual(bk.name, "Book 7")
+        self.assertEqual(bk.rate, 7.0)
+        self.assertEqual(KingBook.objects.bulk_create([]), [])
+
+
+    def test_save(self):
+        bk = KingBook(name="Brad Pete", rate=2.5)
+        bk.save()
+        self.assertIsNotNone(bk.id)
+
+        bk = KingBook.objects.get(id=bk.id)
+        bk.name = "Brad Pitt"
+        bk.rate = 4
+        # Row check + one upsert (inside a savepoint), whatever the number of fields
+        with self.assertNumQueries(4):
+            bk.save()
+
+        bk = KingBook.objects.get(id=bk.id)
+        self.assertEqual(bk.name, "Brad Pitt")
+        self.assertEqual(bk.rate, 4.0)
+        # Updated in place: one cell per column
+        self.assertEqual(Cell.objects.filter(primary_key_id=bk.id).count(), 3)
 
 
     def test_views(self):
@@ -171,11 +467,581 @@ class DynamicDBModelModelTests(TestCase):
         
         response = self.client.post(url_table_table_rows, {'col_1':'test col_1', 'col_2':'test col_2', 'col_3':'test col_3', 'col_4':'test col_4'}) # blank data dictionary
         self.assertEqual(response.status_code, 201)
+        row = json.loads(response.content.decode())['data'][0]
+        self.assertEqual(row['col_1'], 'test col_1')
+        self.assertEqual(self.client.get(url_table_table_rows, {'after': row['id'] - 1}).json()['data'], [row])
+
+        # The columns are resolved once per table, not once per field
+        Column.objects.bulk_create([Column(table=t, name="wide_%s" % i) for i in range(50)])
+        schema_registry.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url_table_table_rows, {'col_1': 'wide', 'wide_7': 'seven'})
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+        row = response.json()['data'][0]
+        self.assertEqual((row['wide_7'], row['wide_8'], row['col_2']), ('seven', None, None))
+
+        response = self.client.post(url_table_table_rows, {'no_such_column': 'x'})
+        self.assertEqual(response.status_code, 400)
         
-        url_table_row_details = reverse('table-row-details', args=(t.id, 3,))
+        r = t.rows.order_by('pk').first()
+        url_table_row_details = reverse('table-row-details', args=(t.id, r.pk,))
         response = self.client.get(url_table_row_details)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['id'], r.pk)
+        self.assertEqual(response.json()['data']['col_1'], Cell.objects.get(primary_key=r, value_type__name='col_1').value)
+
+        url_table_row_details = reverse('table-row-details', args=(t.id, 0,))
+        self.assertEqual(self.client.get(url_table_row_details).status_code, 404)
+
+
+    def test_schema_registry(self):
+        qs = DynamicDBModelQuerySet(KingBook)
+        self.assertIsNone(qs._get_custom_annotation("testTable_3"))
+
+        t = Table.objects.get(name="testTable_1")
+        annotations = qs._get_custom_annotation("testTable_1")
+        self.assertEqual(list(annotations), ["col_1", "col_2", "col_3", "col_4"])
+
+        # Served from the registry
+        with self.assertNumQueries(0):
+            qs._get_custom_annotation("testTable_1")
+            schema_registry.get(table_id=t.id)
+
+        # Invalidated by Column signals
+        col = Column.objects.create(table=t, name="col_5")
+        self.assertIn("col_5", qs._get_custom_annotation("testTable_1"))
+        col.delete()
+        self.assertNotIn("col_5", qs._get_custom_annotation("testTable_1"))
+
+        # Invalidated by Table signals
+        t.name = "testTable_3"
+        t.save()
+        self.assertIsNone(qs._get_custom_annotation("testTable_1"))
+        self.assertEqual(schema_registry.get(table_id=t.id).table_name, "testTable_3")
+
+        # Cross-process version stamp
+        with self.settings(DYNAMIC_DATABASE_SCHEMA_CACHE='default'):
+            schema = schema_registry.get(table_id=t.id)
+            self.assertIs(schema_registry.get(table_id=t.id), schema)
+            # Another process changed the schema
+            schema_registry._bump_version(t.id)
+            self.assertIsNot(schema_registry.get(table_id=t.id), schema)
+
+
+    def test_views_streaming(self):
+        t = Table.objects.get(name="testTable_1")
+        url_table_table_rows = reverse('table-rows', args=(t.id,))
+        expected = json.loads(self.client.get(url_table_table_rows).content.decode())
+
+        response = self.client.get(url_table_table_rows, {'stream': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode()), expected)
+
+        response = self.client.get(url_table_table_rows, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected['data'])
+
+
+    def test_views_pagination(self):
+        t = Table.objects.get(name="testTable_1")
+        url_table_table_rows = reverse('table-rows', args=(t.id,))
+        ids = list(t.rows.order_by('id').values_list('id', flat=True))
+
+        response = self.client.get(url_table_table_rows, {'limit': 12})
+        page = json.loads(response.content.decode())
+        self.assertEqual([row['id'] for row in page['data']], ids[:12])
+        self.assertEqual(page['next'], ids[11])
+
+        response = self.client.get(url_table_table_rows, {'after': page['next'], 'limit': 12, 'stream': 'json'})
+        page = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual([row['id'] for row in page['data']], ids[12:24])
+
+        response = self.client.get(url_table_table_rows, {'after': page['next'], 'limit': 12})
+        page = json.loads(response.content.decode())
+        self.assertEqual([row['id'] for row in page['data']], ids[24:])
+        self.assertIsNone(page['next'])
+
+        response = self.client.get(url_table_table_rows, {'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_views_import(self):
+        t = Table.objects.get(name="testTable_1")
+        Column.objects.create(table=t, name="rate", data_type=Column.INTEGER)
+        url_import = reverse('table-rows-import', args=(t.id,))
+        count = t.rows.count()
+
+        body = 'col_1,rate\nfirst,1\nsecond,x\nthird\n"fourth, quoted",4\n'
+        response = self.client.post(url_import, body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        result = response.json()
+        self.assertEqual(result['rows'], 2)
+        self.assertEqual([error['line'] for error in result['errors']], [3, 4])
+        self.assertIn('rows_per_second', result)
+        self.assertEqual(t.rows.count(), count + 2)
+        url_row = reverse('table-row-details', args=(t.id, t.rows.order_by('pk').last().pk))
+        row = self.client.get(url_row).json()['data']
+        self.assertEqual((row['col_1'], row['rate'], row['col_2']), ('fourth, quoted', 4, None))
+
+        # Integers are stored in int_value, without going through a float
+        body = 'rate\n9007199254740993\n'
+        self.client.post(url_import, body, content_type='text/csv')
+        cell = Cell.objects.filter(value_type__name="rate", table=t).latest('pk')
+        self.assertEqual((cell.int_value, cell.num_value), (9007199254740993, None))
+        cell.primary_key.delete()
+
+        body = '{"col_2": "a", "rate": 7}\n\nnot json\n{"nope": 1}\n[1]\n{"col_2": "b"}\n'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url_import, body, content_type='application/x-ndjson')
+        result = response.json()
+        self.assertEqual(result['rows'], 2)
+        self.assertEqual([error['line'] for error in result['errors']], [3, 4, 5])
+        # The batch is written at once, whatever the number of rows
+        self.assertLessEqual(len(ctx.captured_queries), 12)
+
+        # A batch rejected by the database is written again row by row: only
+        # the lines rejected are reported
+        def reject(sender, table_id, row_ids, **kwargs):
+            if Cell.objects.filter(primary_key_id__in=row_ids, value='reject').exists():
+                raise DatabaseError('Rejected.')
+
+        post_rows_save.connect(reject)
+        try:
+            response = self.client.post(url_import, 'col_2\na\nreject\nb\n', content_type='text/csv')
+        finally:
+            post_rows_save.disconnect(reject)
+        result = response.json()
+        self.assertEqual(result['rows'], 2)
+        self.assertEqual(result['errors'], [{'line': 3, 'detail': 'Rejected.'}])
+        self.assertFalse(Cell.objects.filter(table=t, value='reject').exists())
+
+        response = self.client.post(url_import, 'col_1,nope\na,b\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url_import, '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(t.rows.count(), count + 6)
+
+
+    def test_column_data_type(self):
+        t = Table.objects.get(name="testTable_1")
+        pages = Column.objects.create(table=t, name="pages")
+        url_rows = reverse('table-rows', args=(t.id,))
+        ids = [self.client.post(url_rows, {'pages': val}).json()['data'][0]['id'] for val in ('42', 'many')]
+
+        # The cells are converted with the type of their column
+        columns = [{'id': col.id, 'name': col.name, 'data_type': col.data_type} for col in t.columns.order_by('id')]
+        columns[-1]['data_type'] = Column.INTEGER
+        response = self.client.put(
+            reverse('table-details', args=(t.id,)), json.dumps({'name': t.name, 'columns': columns}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        rows = [self.client.get(reverse('table-row-details', args=(t.id, pk))).json()['data'] for pk in ids]
+        self.assertEqual([row['pages'] for row in rows], [42, None])
+        self.assertEqual(
+            list(Cell.objects.filter(value_type=pages).order_by('pk').values_list('value', 'int_value')),
+            [('42', 42), ('many', None)],
+        )
+
+
+    def test_export(self):
+        t = Table.objects.get(name="testTable_1")
+        rate = Column.objects.create(table=t, name="rate", data_type=Column.FLOAT)
+        schema = schema_registry.get(table_id=t.id)
+        cells = dict(Cell.objects.filter(table=t, value_type__name='col_2').values_list('primary_key_id', 'value'))
+        ids = sorted(t.rows.values_list('id', flat=True))
+
+        url_export = reverse('table-rows-export', args=(t.id,))
+        response = self.client.get(url_export)
+        self.assertTrue(response.streaming)
+        lines = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(lines[0], ['id', 'col_1', 'col_2', 'col_3', 'col_4', 'rate'])
+        self.assertEqual([int(line[0]) for line in lines[1:]], ids)
+        self.assertEqual(lines[1][2], cells[ids[0]])
+
+        response = self.client.get(url_export, {'output': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], ids)
+        self.assertIsNone(rows[0]['rate'])
+        self.assertEqual(self.client.get(url_export, {'output': 'xml'}).status_code, 400)
+
+        # Same rows, whatever the chunk size
+        Cell.objects.create(table=t, primary_key_id=ids[3], value_type=rate, value='2.5', num_value=2.5)
+        data = b''.join(exports.export_rows(schema, exports.COLUMNAR, chunk_size=7))
+        names, rows = exports.decode_columnar(BytesIO(data))
+        self.assertEqual(names, ['id', 'col_1', 'col_2', 'col_3', 'col_4', 'rate'])
+        self.assertEqual([row[0] for row in rows], ids)
+        self.assertEqual((rows[3][5], rows[4][5], rows[0][2]), (2.5, None, cells[ids[0]]))
+
+        path = os.path.join(tempfile.mkdtemp(), 'export.csv')
+        call_command('export_table', 'testTable_1', '--chunk-size', '4', '-o', path)
+        with open(path, newline='') as f:
+            self.assertEqual(f.read().encode(), b''.join(self.client.get(url_export).streaming_content))
+        os.remove(path)
+
+
+    @override_settings(DYNAMIC_DATABASE_PARTITION_CELLS=True)
+    def test_partitions(self):
+        self.assertEqual(partitions.get_partition_name(7), 'django_dynamic_database_cell_p7')
+        if connection.vendor != 'postgresql':
+            # The layout is PostgreSQL only: the setting is ignored elsewhere
+            self.assertFalse(partitions.is_enabled())
+            with self.assertRaises(CommandError):
+                call_command('partition_cells', stdout=StringIO())
+        # Until partition_cells has run, the tables have no partition
+        with mock.patch.object(partitions, 'is_enabled', return_value=True), \
+                mock.patch.object(partitions, 'create_partition') as create_partition:
+            t = Table.objects.create(name="partitioned")
+        self.assertEqual(create_partition.called, partitions.is_partitioned())
+        Column.objects.create(table=t, name="col_1")
+        self.assertEqual(self.client.post(reverse('table-rows', args=(t.id,)), {'col_1': 'a'}).status_code, 201)
+        t.delete()
+        self.assertFalse(Cell.objects.filter(table_id=t.id).exists())
+        self.assertEqual(Cell.objects.filter(table__name="testTable_1").count(), 120)
+
+
+    def test_drops(self):
+        t = Table.objects.get(name="testTable_1")
+        column = t.columns.get(name="col_2")
+        progress = drops.drop_column(column, batch_size=7)
+        self.assertEqual((progress['cells'], progress['done']), (30, True))
+        self.assertFalse(Column.objects.filter(pk=column.pk).exists())
+        self.assertEqual(Cell.objects.filter(table=t).count(), 90)
+
+        # Cells, then rows, in batches of consecutive ids
+        with CaptureQueriesContext(connection) as ctx:
+            progress = drops.drop_table(t, batch_size=25)
+        self.assertEqual((progress['cells'], progress['rows']), (90, 30))
+        deletes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('DELETE')]
+        self.assertGreater(len(deletes), 2)
+        self.assertFalse(Table.objects.filter(name="testTable_1").exists())
+        self.assertFalse(Row.objects.filter(table_id=t.pk).exists())
+        self.assertEqual(Cell.objects.count(), 120)
+
+        out = StringIO()
+        call_command('drop_table', 'testTable_2', '--batch-size', '50', verbosity=2, stdout=out)
+        self.assertIn('Dropped testTable_2 (120 cells, 30 rows).', out.getvalue())
+        self.assertFalse(Cell.objects.exists())
+
+        t = Table.objects.create(name="dropped")
+        # Another job drops the table: its progress is returned
+        Table.objects.filter(pk=t.pk).update(drop_heartbeat=timezone.now(), dropped_cells=12)
+        response = self.client.delete(reverse('table-details', args=(t.id,)), QUERY_STRING='background=true')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.json()['cells'], response.json()['running']), (12, True))
+        with self.assertRaises(drops.DropInProgress):
+            drops.drop_table(t)
+        # Until its heartbeat is too old
+        Table.objects.filter(pk=t.pk).update(drop_heartbeat=timezone.now() - datetime.timedelta(hours=1))
+        response = self.client.delete(reverse('table-details', args=(t.id,)))
         self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.delete(reverse('table-details', args=(t.id,))).status_code, 404)
+
+        # The partition of a table, if any, is dropped instead of deleting
+        # its cells in batches
+        t = Table.objects.create(name="partitioned")
+        table_id = t.pk
+        Column.objects.create(table=t, name="col_1")
+        schema = schema_registry.get(table_id=table_id)
+        for i in range(3):
+            insert_row(schema, {"col_1": i})
+
+        def drop_partition(table_id):
+            Cell.objects.filter(table_id=table_id)._raw_delete(connection.alias)
+
+        with mock.patch.object(partitions, 'has_partition', return_value=True), \
+                mock.patch.object(partitions, 'drop_partition', side_effect=drop_partition) as patched:
+            with CaptureQueriesContext(connection) as ctx:
+                progress = drops.drop_table(t, batch_size=2)
+        patched.assert_called_once_with(table_id)
+        self.assertEqual((progress['cells'], progress['rows']), (0, 3))
+        self.assertFalse([
+            q for q in ctx.captured_queries
+            if q['sql'].startswith('DELETE FROM "django_dynamic_database_cell"') and '"id" >=' in q['sql']
+        ])
+        self.assertFalse(Table.objects.filter(pk=table_id).exists())
+
+
+    def test_instrumentation(self):
+        operations = []
+
+        def receiver(sender, operation, stats, **kwargs):
+            operations.append((operation, stats))
+
+        operation_finished.connect(receiver)
+        try:
+            KingBook.objects.create(name="Tony Stark", rate=3.5)
+            self.assertEqual(operations, [])
+
+            with override_settings(DYNAMIC_DATABASE_INSTRUMENTATION=True):
+                with override_settings(DYNAMIC_DATABASE_SLOW_QUERY_MS=0):
+                    with self.assertLogs('django_dynamic_database', 'WARNING') as logs:
+                        bk = KingBook.objects.get(name="Tony Stark")
+                # One operation for the call, whatever it calls
+                self.assertEqual([operation for operation, stats in operations], ['KingBook.get'])
+                stats = operations[0][1]
+                self.assertGreater(stats['queries'], 0)
+                self.assertGreater(stats['sql_time'], 0)
+                self.assertIn('Slow query in KingBook.get', logs.output[0])
+                self.assertIn('SELECT', logs.output[0])
+
+                # A queryset is measured when it is evaluated
+                del operations[:]
+                qs = KingBook.objects.filter(rate__gt=1)
+                self.assertEqual(operations[0][1]['queries'], 0)
+                self.assertEqual(len(list(qs)), 1)
+                self.assertEqual([operation for operation, stats in operations], ['KingBook.filter', 'KingBook.filter'])
+                self.assertEqual(operations[1][1]['rows'], 1)
+
+                # and so are the querysets chained from it
+                del operations[:]
+                self.assertEqual(len(list(qs.order_by('-rate').exclude(rate__gt=4))), 1)
+                self.assertEqual([operation for operation, stats in operations], ['KingBook.filter'])
+                self.assertEqual(operations[0][1]['rows'], 1)
+                del operations[:]
+                self.assertEqual(len(list(KingBook.objects.all())), 1)
+                self.assertEqual([operation for operation, stats in operations], ['KingBook.all'])
+                del operations[:]
+                self.assertEqual(qs.order_by('-rate').count(), 1)
+                self.assertEqual(KingBook.objects.aggregate(models.Max('rate')), {'rate__max': 3.5})
+                self.assertEqual([operation for operation, stats in operations], ['KingBook.filter', 'KingBook.aggregate'])
+                self.assertGreater(operations[1][1]['queries'], 0)
+
+                # The model instances
+                del operations[:]
+                bk = KingBook(name="Peter Parker", rate=1)
+                bk.save()
+                KingBook(id=bk.id).delete()
+                self.assertEqual([operation for operation, stats in operations], ['KingBook.save', 'KingBook.delete'])
+
+                del operations[:]
+                t = Table.objects.get(name="testTable_1")
+                self.client.get(reverse('table-details', args=(t.id,)))
+                self.assertEqual(operations[0][0], 'TableDetail.get')
+        finally:
+            operation_finished.disconnect(receiver)
+
+
+@override_settings(ROOT_URLCONF='django_dynamic_database.urls')
+class DynamicDBTransactionTests(TransactionTestCase):
+    """
+    Caches shared between transactions, invalidated when they commit.
+    """
+
+    def setUp(self):
+        schema_registry.clear()
+        self.client = Client()
+
+
+    def test_schema_registry_commit(self):
+        t = Table.objects.create(name="testTable_1")
+        Column.objects.create(table=t, name="col_1")
+        qs = DynamicDBModelQuerySet(KingBook)
+        schema = schema_registry.get(table_id=t.id)
+
+        # The transaction reads its own schema, the others the committed one
+        with transaction.atomic():
+            Column.objects.create(table=t, name="col_2")
+            self.assertEqual(list(qs._get_custom_annotation("testTable_1")), ["col_1", "col_2"])
+            self.assertIs(schema_registry._by_id[t.id], schema)
+        self.assertIsNot(schema_registry.get(table_id=t.id), schema)
+        self.assertEqual(list(qs._get_custom_annotation("testTable_1")), ["col_1", "col_2"])
+
+        # Nothing is dropped when it rolls back
+        schema = schema_registry.get(table_id=t.id)
+        try:
+            with transaction.atomic():
+                t.name = "testTable_2"
+                t.save()
+                self.assertIsNone(qs._get_custom_annotation("testTable_1"))
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertIs(schema_registry.get(table_name="testTable_1"), schema)
+        self.assertIsNone(schema_registry.get(table_name="testTable_2"))
+
+        # Nor read by the next transaction of the thread, nor after a
+        # savepoint rolled back
+        try:
+            with transaction.atomic():
+                Column.objects.create(table=t, name="ghost")
+                self.assertIn("ghost", schema_registry.get(table_id=t.id).column_ids)
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            self.assertNotIn("ghost", schema_registry.get(table_id=t.id).column_ids)
+            insert_row(schema_registry.get(table_id=t.id), {"col_1": "a"})
+            try:
+                with transaction.atomic():
+                    Column.objects.create(table=t, name="ghost")
+                    self.assertIn("ghost", schema_registry.get(table_id=t.id).column_ids)
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertNotIn("ghost", schema_registry.get(table_id=t.id).column_ids)
+            insert_row(schema_registry.get(table_id=t.id), {"col_1": "b"})
+        self.assertEqual(Cell.objects.filter(table=t).count(), 4)
+
+
+    @override_settings(DYNAMIC_DATABASE_RESULT_CACHE='default', DYNAMIC_DATABASE_RESULT_CACHE_MAX_ROWS=2)
+    def test_result_cache(self):
+        bk1 = KingBook.objects.create(name="Tony Stark", rate=3.5)
+        stats = result_cache.get_stats()
+
+        rows = KingBook.objects.cached()
+        with self.assertNumQueries(0):
+            self.assertEqual(KingBook.objects.cached(), rows)
+        self.assertEqual(rows, list(KingBook.objects.all()))
+        self.assertEqual(result_cache.hits - stats['hits'], 1)
+        self.assertEqual(result_cache.misses - stats['misses'], 1)
+
+        # Cached as (column names, tuples)
+        names, values = result_cache._pack(rows)
+        self.assertEqual(set(names), {'id', 'name', 'rate', 'weight'})
+        self.assertIsInstance(values[0], tuple)
+        self.assertEqual(result_cache._unpack((names, values)), rows)
+
+        # The transaction that writes does not read the cache
+        with transaction.atomic():
+            KingBook.objects.create(name="Bruce Wayne", rate=1)
+            self.assertEqual(len(KingBook.objects.cached()), 2)
+            self.assertEqual(len(rows), 1)
+        self.assertEqual(len(KingBook.objects.cached()), 2)
+        KingBook.objects.filter(name="Bruce Wayne").delete()
+
+        # Every write path bumps the version of the table
+        KingBook.objects.create(name="John Wick", rate=5)
+        self.assertEqual(len(KingBook.objects.cached()), 2)
+        KingBook.objects.filter(name="John Wick").update(rate=4)
+        self.assertEqual(sorted(row['rate'] for row in KingBook.objects.cached()), [3.5, 4.0])
+        bk1.delete()
+        self.assertEqual([row['name'] for row in KingBook.objects.cached()], ["John Wick"])
+        t = Table.objects.get(name="king_book")
+        self.client.post(reverse('table-rows', args=(t.id,)), {'name': "Will Smith"})
+        self.assertEqual(len(KingBook.objects.cached(KingBook.objects.values_list('name', flat=True))), 2)
+        self.assertGreaterEqual(result_cache.invalidations - stats['invalidations'], 4)
+
+        # Results over DYNAMIC_DATABASE_RESULT_CACHE_MAX_ROWS are not kept
+        KingBook.objects.create(name="Brad Pitt", rate=2)
+        misses = result_cache.misses
+        KingBook.objects.cached()
+        KingBook.objects.cached()
+        self.assertEqual(result_cache.misses - misses, 2)
+
+
+    def test_views_conditional(self):
+        t = Table.objects.create(name="testTable_1")
+        Column.objects.create(table=t, name="col_1")
+        Table.objects.create(name="testTable_2")
+        self.client.post(reverse('table-rows', args=(t.id,)), {'col_1': 'value'})
+        url_table_table_rows = reverse('table-rows', args=(t.id,))
+        response = self.client.get(url_table_table_rows)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+
+        # Answered from the Table row alone
+        with self.assertNumQueries(1):
+            response = self.client.get(url_table_table_rows, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get(url_table_table_rows, {'limit': 5})['ETag'], etag)
+
+        # Every write path moves the tag forward
+        self.client.post(url_table_table_rows, {'col_1': 'new'})
+        response = self.client.get(url_table_table_rows, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        Column.objects.create(table=t, name="col_5")
+        self.assertEqual(self.client.get(url_table_table_rows, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Bumped once per transaction, when it commits
+        version = Table.objects.get(pk=t.pk).version
+        with transaction.atomic():
+            self.client.post(url_table_table_rows, {'col_1': 'one'})
+            self.client.post(url_table_table_rows, {'col_1': 'two'})
+            self.assertEqual(Table.objects.get(pk=t.pk).version, version)
+        self.assertEqual(Table.objects.get(pk=t.pk).version, version + 1)
+
+        r = t.rows.first()
+        url_table_row_details = reverse('table-row-details', args=(t.id, r.pk))
+        etag = self.client.get(url_table_row_details)['ETag']
+        self.assertEqual(self.client.get(url_table_row_details, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        url_table_list = reverse('tables')
+        etag = self.client.get(url_table_list)['ETag']
+        self.assertEqual(self.client.get(url_table_list, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Table.objects.get(name="testTable_2").delete()
+        self.assertEqual(self.client.get(url_table_list, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+    @override_settings(DYNAMIC_DATABASE_SCHEMA_CACHE='default')
+    def test_materialized(self):
+        KingBook.objects.create(name="Tony Stark", rate=3.5)
+        KingBook.objects.create(name="John Wick", rate=5)
+        call_command('materialize_table', 'king_book', stdout=StringIO())
+        t = Table.objects.get(name="king_book")
+        self.assertTrue(t.materialized)
+
+        # Read from the wide table, without aggregating the cells
+        qs = KingBook.objects.filter(name="Tony Stark")
+        self.assertIn(get_table_name(t.id), str(qs.query))
+        self.assertNotIn('GROUP BY', str(qs.query))
+        self.assertEqual(qs.get()['rate'], 3.5)
+
+        # Kept up to date by the write paths
+        bk = KingBook.objects.create(name="Will Smith", rate=3)
+        KingBook.objects.bulk_create([KingBook(name="Brad Pete", rate=2)])
+        bk.name = "Will Smith Jr"
+        bk.save()
+        KingBook.objects.filter(rate__gt=4).update(rate=4.5)
+        KingBook.objects.get(name="Tony Stark").delete()
+        self.assertEqual(
+            sorted((bk['name'], bk['rate']) for bk in KingBook.objects.all()),
+            [("Brad Pete", 2.0), ("John Wick", 4.5), ("Will Smith Jr", 3.0)],
+        )
+        self.assertEqual(KingBook.objects.aggregate(models.Max('rate')), {'rate__max': 4.5})
+
+        # Schema changes are applied to the wide table when they commit: the
+        # transaction reads the cells until then
+        with transaction.atomic():
+            col = Column.objects.create(table=t, name="pages", data_type=Column.INTEGER)
+            response = self.client.post(reverse('table-rows', args=(t.id,)), {'name': "Bruce Wayne", 'pages': 120})
+            row_id = response.json()['data'][0]['id']
+            self.assertNotIn(get_table_name(t.id), str(KingBook.objects.all().query))
+        with connection.cursor() as cursor:
+            columns = [c.name for c in connection.introspection.get_table_description(cursor, get_table_name(t.id))]
+        self.assertIn('c_%s' % col.id, columns)
+        self.assertIn(get_table_name(t.id), str(KingBook.objects.all().query))
+        pivot = materialized.get_pivot_model(schema_registry.get(table_id=t.id))
+        self.assertEqual(pivot.objects.get(id=row_id).pages, 120)
+        col.delete()
+        self.assertEqual(KingBook.objects.count(), 4)
+        # One pivot model per table
+        self.assertEqual(list(materialized._pivot_models), [t.id])
+        self.assertEqual(len(materialized.pivot_apps.all_models['django_dynamic_database']), 1)
 
+        # A column change rolled back leaves nothing pending: the rows
+        # written by the next transaction reach the wide table
+        try:
+            with transaction.atomic():
+                Column.objects.create(table=t, name="ghost")
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            bk = KingBook.objects.create(name="Peter Parker", rate=1)
+        pivot = materialized.get_pivot_model(schema_registry.get(table_id=t.id))
+        self.assertEqual(pivot.objects.get(id=bk.id).name, "Peter Parker")
 
+        # Dropped with the table
+        t.delete()
+        with connection.cursor() as cursor:
+            self.assertNotIn(get_table_name(t.id), connection.introspection.table_names(cursor))
 
-    
+        # Every process must see the materialized tables
+        with self.settings(DYNAMIC_DATABASE_SCHEMA_CACHE=None):
+            with self.assertRaises(ImproperlyConfigured):
+                materialized.materialize_table(Table.objects.create(name="other"))
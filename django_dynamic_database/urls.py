@@ -1,6 +1,6 @@
 from django.conf.urls import url
 
-from .views import TableList, TableDetail, EntityList, EntityDetail
+from .views import TableList, TableDetail, EntityList, EntityImport, EntityExport, EntityDetail
 
 app_name = 'django_dynamic_database'
 
@@ -20,6 +20,16 @@ urlpatterns = [
         EntityList.as_view(),
         name='table-rows'
     ),
+    url(
+        r'^tables/(?P<table_id>\d+)/views/import/$',
+        EntityImport.as_view(),
+        name='table-rows-import'
+    ),
+    url(
+        r'^tables/(?P<table_id>\d+)/views/export/$',
+        EntityExport.as_view(),
+        name='table-rows-export'
+    ),
     url(
         r'^tables/(?P<table_id>\d+)/views/(?P<pk>\d+)/$',
         EntityDetail.as_view(),
@@ -1,26 +1,87 @@
+import codecs
 import json
+import zlib
 from django.core import serializers
-from django.http import HttpResponse, JsonResponse, Http404
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import permissions, status, views
 # from rest_framework.decorators import api_view
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
 
 from .models import Table, Column, Row, Cell
 
+from . import documents, drops, exports, imports
+from .renderers import NDJSONRenderer
+from .signals import post_rows_save
 from .serializers import RowSerializer, ColumnSerializer, TableSerializer, CellSerializer
 
-from .django_dynamic_database import convert, DynamicDBModelQuerySet
+from .instrumentation import instrumented
+from .django_dynamic_database import convert, get_cell_values, insert_row, schema_registry, DynamicDBModelQuerySet
+
+
+# Conditional GET. Every write path bumps Table.version and Table.modified
+# (see receivers.py), so the validators are read from the Table row alone and
+# a matching If-None-Match is answered with a 304 before any pivot query.
+
+def get_table_stamp(request, table_id):
+    """
+    Return (version, modified) of the table, None if it does not exist. The
+    Table row is read once per request.
+    """
+    stamps = getattr(request, '_table_stamps', None)
+    if stamps is None:
+        stamps = request._table_stamps = {}
+    table_id = int(table_id)
+    if table_id not in stamps:
+        stamps[table_id] = Table.objects.filter(pk=table_id).values_list('version', 'modified').first()
+    return stamps[table_id]
+
+
+def table_etag(request, table_id=None, pk=None, **kwargs):
+    if table_id is None:
+        # TableDetail
+        table_id = pk
+    stamp = get_table_stamp(request, table_id)
+    if stamp is None:
+        return None
+    # The representation depends on the query string (pages, stream) and on
+    # the negotiated renderer: they are part of the tag.
+    variant = '%s %s' % (request.META.get('QUERY_STRING', ''), request.META.get('HTTP_ACCEPT', ''))
+    return 'W/"%s-%s-%x"' % (table_id, stamp[0], zlib.crc32(variant.encode('utf-8')))
+
+
+def table_last_modified(request, table_id=None, pk=None, **kwargs):
+    stamp = get_table_stamp(request, pk if table_id is None else table_id)
+    return stamp[1] if stamp is not None else None
+
+
+def table_list_etag(request, **kwargs):
+    # One aggregate for the whole list: a created, deleted or modified table
+    # changes one of the terms
+    stamp = Table.objects.aggregate(Count('id'), Max('id'), Sum('version'))
+    return 'W/"%s-%s-%s"' % (stamp['id__count'], stamp['id__max'] or 0, stamp['version__sum'] or 0)
+
+
+table_condition = method_decorator(condition(etag_func=table_etag, last_modified_func=table_last_modified))
 
 
 class TableList(APIView):
 
+    # No Last-Modified: deleting a table does not move it forward
+    @instrumented
+    @method_decorator(condition(etag_func=table_list_etag))
     def get(self, request, format=None):
         tables = Table.objects.all()
         serializer = TableSerializer(tables, many=True)
         return Response(serializer.data)
 
+    @instrumented
     def post(self, request, format=None):
         serializer = TableSerializer(data=request.data)
         if serializer.is_valid():
@@ -37,11 +98,14 @@ class TableDetail(APIView):
         except Table.DoesNotExist:
             raise Http404
 
+    @instrumented
+    @table_condition
     def get(self, request, pk, format=None):
         table = self.get_object(pk)
         serializer = TableSerializer(table)
         return Response(serializer.data)
 
+    @instrumented
     def put(self, request, pk, format=None):
         table = self.get_object(pk)
         serializer = TableSerializer(table, data=request.data)
@@ -51,9 +115,18 @@ class TableDetail(APIView):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @instrumented
     def delete(self, request, pk, format=None):
         table = self.get_object(pk)
-        table.delete()
+        if request.query_params.get('background') in ('1', 'true'):
+            # Repeat the request to follow the progress: 404 once dropped
+            drops.DropJob(table).start()
+            return Response(drops.get_progress(table.pk), status=status.HTTP_202_ACCEPTED)
+        try:
+            drops.drop_table(table)
+        except drops.DropInProgress:
+            # Dropped by a background job
+            return Response(drops.get_progress(table.pk), status=status.HTTP_202_ACCEPTED)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -62,46 +135,64 @@ class TableDetail(APIView):
 
 class EntityList(APIView):
 
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+
+    # Rows fetched per database round-trip when streaming
+    stream_chunk_size = 2000
+
+    # Page size of ?after=&limit= keyset pagination
+    default_page_size = 100
+    max_page_size = 1000
+
 
-    def get_queryset(self, table_name):
+    def get_queryset(self, table_name, row_ids=None):
         annotations = DynamicDBModelQuerySet(self)._get_custom_annotation(table_name)
         if annotations is None:
             qs = models.QuerySet(self.model).none()
         column_names = [k for k in annotations]
         values = DynamicDBModelQuerySet(self)._get_query_values(column_names)
-        return Cell.objects.filter(primary_key__table__name=table_name).values('primary_key').annotate(**annotations).values(**values).order_by()
+        schema = schema_registry.get(table_name=table_name)
+        # On table_id rather than the name: PostgreSQL reads the partition of
+        # the table only (see partitions.py)
+        cells = Cell.objects.filter(table_id=schema.table_id if schema is not None else None)
+        if row_ids is not None:
+            cells = cells.filter(primary_key_id__in=row_ids)
+        return cells.values('primary_key').annotate(**annotations).values(**values).order_by()
+
+    def get_page(self, request, schema):
+        """
+        Keyset pagination on row id: return (ids of the rows of the page,
+        cursor of the next page), or None when no page was requested.
+        """
+        params = request.query_params
+        if 'after' not in params and 'limit' not in params:
+            return None
+        after = int(params.get('after', 0))
+        limit = min(int(params.get('limit', self.default_page_size)), self.max_page_size)
+        if limit < 1:
+            raise ValueError('limit must be positive.')
+        # Seek on the Row primary key: the cost does not depend on the page
+        # number. Ids are fetched first because MySQL rejects LIMIT inside
+        # an IN subquery.
+        row_ids = list(
+            Row.objects.filter(table_id=schema.table_id, id__gt=after)
+            .order_by('id').values_list('id', flat=True)[:limit + 1]
+        )
+        next_cursor = row_ids[limit - 1] if len(row_ids) > limit else None
+        return row_ids[:limit], next_cursor
     
-    def create(self, validated_data, table_obj):
-        defaults = None
-        objs = []
-        if table_obj:
-            # Create row to initialize pk
-            row_obj = Row.objects.create(table=table_obj)
-            if row_obj is not None:
-                annotations = DynamicDBModelQuerySet(self)._get_custom_annotation(table_name=table_obj.name)
-                column_names = [str(k) for k in annotations]
-                defaults = {str(k):str(k) for k in column_names}
-                for attr, val in list(validated_data.items()):
-                    defaults.pop(attr)
-                    col_obj = Column.objects.get(table=table_obj, name=attr)
-                    objs.append(Cell(primary_key=row_obj, value_type=col_obj, value=str(val)))
-                for attr in defaults:
-                    col_obj = Column.objects.get(table=table_obj, name=attr)
-                    objs.append(Cell(primary_key=row_obj, value_type=col_obj, value=null))
-                Cell.objects.bulk_create(objs)
-                values = DynamicDBModelQuerySet(self)._get_query_values(column_names)
-            try:
-                obj = Cell.objects.values('primary_key').annotate(**annotations).filter(primary_key=row_obj).values(**values).order_by()
-                return obj
-            except ValueError:
-                raise serializers.ValidationError('Please check yours fields values.')
+    def create(self, validated_data, schema):
+        # One query per table for the schema, two INSERT for the row
+        return insert_row(schema, validated_data)
 
     def update(self, validated_data, table_obj):
         
         row_id = validated_data.pop('id')
             
         for attr, val in validated_data.items():
-            Cell.objects.filter(primary_key__id=row_id, value_type=Column.objects.get(table=table_obj, name=attr)).update(value=val)
+            col_obj = Column.objects.get(table=table_obj, name=attr)
+            Cell.objects.filter(primary_key__id=row_id, value_type=col_obj).update(**get_cell_values(col_obj.data_type, val))
+        post_rows_save.send(sender=Table, table_id=table_obj.pk, row_ids=[row_id])
             
         try:
             obj = Cell.objects.values('primary_key').annotate(**annotations).filter(primary_key=row_obj).values(**values).order_by()
@@ -110,31 +201,153 @@ class EntityList(APIView):
             raise serializers.ValidationError('Please check yours fields values.')
 
 
+    @instrumented
+    @table_condition
     def get(self, request, table_id):
-        table = Table.objects.get(pk=table_id)
-        qset = self.get_queryset(table.name)
+        schema = schema_registry.get(table_id=int(table_id))
+        if schema is None:
+            raise Http404
+        try:
+            page = self.get_page(request, schema)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        extra = {}
+        row_ids = None
+        if page is not None:
+            row_ids, extra['next'] = page
+        if documents.is_enabled():
+            # Read from Row alone
+            qset = documents.get_rows(schema, row_ids)
+            if page is not None:
+                qset = qset.order_by('pk')
+        else:
+            qset = self.get_queryset(schema.table_name, row_ids)
+            if page is not None:
+                qset = qset.order_by('primary_key')
+        stream = self.get_stream_format(request)
+        if stream is not None:
+            # Server-side cursor on PostgreSQL, constant memory on every backend
+            rows = qset.iterator(chunk_size=self.stream_chunk_size)
+            if stream == 'ndjson':
+                return StreamingHttpResponse(self.stream_ndjson(rows), content_type='application/x-ndjson')
+            return StreamingHttpResponse(self.stream_json(rows, extra), content_type='application/json')
         qs = [ obj for obj in qset ]
-        return HttpResponse(json.dumps({"data": qs}), content_type='application/json')
+        extra['data'] = qs
+        return HttpResponse(json.dumps(extra, cls=DjangoJSONEncoder), content_type='application/json')
 
+    def get_stream_format(self, request):
+        """
+        Return 'json' or 'ndjson' when the client asked for a streamed response
+        with ?stream=json|ndjson or an 'Accept: application/x-ndjson' header,
+        None otherwise.
+        """
+        stream = request.query_params.get('stream')
+        if stream in ('json', 'ndjson'):
+            return stream
+        if stream in ('1', 'true'):
+            return 'json'
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return 'ndjson'
+        return None
 
+    def stream_json(self, rows, extra=None):
+        # Same document as the buffered response, emitted row by row
+        yield '{'
+        for key, val in (extra or {}).items():
+            yield '%s: %s, ' % (json.dumps(key), json.dumps(val, cls=DjangoJSONEncoder))
+        yield '"data": ['
+        separator = ''
+        for obj in rows:
+            yield separator + json.dumps(obj, cls=DjangoJSONEncoder)
+            separator = ', '
+        yield ']}'
+
+    def stream_ndjson(self, rows):
+        for obj in rows:
+            yield json.dumps(obj, cls=DjangoJSONEncoder) + '\n'
+
+
+    @instrumented
     def post(self, request, table_id):
-        print(request.data)
+        schema = schema_registry.get(table_id=int(table_id))
+        if schema is None:
+            raise Http404
+        if request.data.get('id', None) is not None:
+            return Response({'detail': 'Rows are updated with PUT.'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            table_obj = Table.objects.get(pk=table_id)
-            row_id = request.data.get('id', None)
-            if row_id is not None:
-                return Response(e, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                qs = self.create(request.data, table_obj)
-                return HttpResponse(json.dumps({"data": [qs[0]]}), content_type='application/json', status=status.HTTP_201_CREATED)
+            row = self.create(request.data, schema)
         except ValueError as e:
-            return Response(e, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return HttpResponse(json.dumps({"data": [row]}, cls=DjangoJSONEncoder), content_type='application/json', status=status.HTTP_201_CREATED)
         
 
+class EntityImport(APIView):
+    """
+    Bulk import of rows: POST a CSV (text/csv, first line holds the column
+    names) or NDJSON (application/x-ndjson) body. The body is read line by
+    line and the rows are written in batches.
+    """
+
+    batch_size = 5000
+
+    @instrumented
+    def post(self, request, table_id):
+        schema = schema_registry.get(table_id=int(table_id))
+        if schema is None:
+            raise Http404
+        format = imports.get_format(request.content_type)
+        if format is None:
+            return Response({'detail': 'Expected a text/csv or application/x-ndjson body.'}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        # request.data is not read: the body is not loaded in memory
+        lines = codecs.iterdecode(request.stream or [], 'utf-8-sig')
+        try:
+            result = imports.import_rows(schema, lines, format, batch_size=self.batch_size)
+        except (ValueError, UnicodeDecodeError) as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED if result['rows'] else status.HTTP_200_OK)
+
+
+class EntityExport(APIView):
+    """
+    Export of the whole table, streamed in primary key order:
+    ?output=csv (default), ndjson or columnar (see exports.py).
+    """
+
+    chunk_size = exports.CHUNK_SIZE
+
+    @instrumented
+    @table_condition
+    def get(self, request, table_id):
+        schema = schema_registry.get(table_id=int(table_id))
+        if schema is None:
+            raise Http404
+        output = request.query_params.get('output', exports.CSV)
+        if output not in exports.ENCODERS:
+            return Response({'detail': 'Unknown output: %s.' % output}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(
+            exports.export_rows(schema, output, self.chunk_size), content_type=exports.CONTENT_TYPES[output],
+        )
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (schema.table_name, output)
+        return response
+
+
 class EntityDetail(APIView):
 
+    @instrumented
+    @table_condition
     def get(self, request, table_id, pk):
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        schema = schema_registry.get(table_id=int(table_id))
+        if schema is None:
+            raise Http404
+        row = None
+        if documents.is_enabled():
+            row = documents.get_row(schema, int(pk))
+        if row is None:
+            rows = list(EntityList().get_queryset(schema.table_name, [int(pk)]))
+            if not rows:
+                raise Http404
+            row = rows[0]
+        return HttpResponse(json.dumps({"data": row}, cls=DjangoJSONEncoder), content_type='application/json')
 
     def put(self, request, table_id, pk):
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -1,5 +1,13 @@
+import os
+
 from setuptools import setup, find_packages
 
+
+def read(name):
+    with open(os.path.join(os.path.dirname(__file__), name), encoding='utf-8') as f:
+        return f.read()
+
+
 setup(
     name='django-dynamic-database',
     version='0.1.0',
@@ -11,13 +19,14 @@ setup(
     author_email='c.doukoure@outlook.fr',
     license='MIT',
     classifiers=[
-        # 'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
-        # 'Programming Language :: Python :: 3',
-        # 'Programming Language :: Python :: 3.4',
-        # 'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6'
+        'Framework :: Django :: 2.0',
+        'Framework :: Django :: 2.1',
+        'Framework :: Django :: 2.2',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
+    python_requires='>=3.6',
     packages=find_packages(),
-    install_requires=['django>=1.11']
+    install_requires=['django>=2.0', 'djangorestframework']
 )